@@ -0,0 +1,89 @@
+import argparse, asyncio, random, string, time
+from datetime import datetime
+from sqlalchemy import update, bindparam
+from sqlalchemy.future import select
+from common.lib import generate_uuid
+from server.crud import WorldDB
+from server.models import Character, User
+
+USERS = 100
+REPEAT = 2000
+
+
+# Queries as they were before the asyncpg fast path, kept for comparison
+
+async def legacy_get_character_location_by_uuid(db: WorldDB, character_uuid: str):
+    async with db.session() as session:
+        statement = select(Character).where(Character.uuid == character_uuid)
+        result = await session.execute(statement)
+        character = result.scalars().one()
+        return character.map_id, character.x, character.y
+
+
+async def legacy_check_character_name_exists(db: WorldDB, name: str):
+    async with db.session() as session:
+        statement = select(Character).where(Character.name == name)
+        result = await session.execute(statement)
+        return result.scalars().one_or_none() is not None
+
+
+async def legacy_check_user_has_max_characters(db: WorldDB, user_id: int):
+    async with db.session() as session:
+        character_uuids = (await session.execute(select(Character.uuid).where(Character.user_id == user_id))).scalars().all()
+        max_characters = (await session.execute(select(User.max_characters).where(User.id == user_id))).scalar()
+        return len(character_uuids) == max_characters
+
+
+async def legacy_update_characters(db: WorldDB, characters: list):
+    table = Character.__table__
+    statement = update(table).where(table.c.uuid == bindparam("character_uuid")).values(
+        map_id=bindparam("character_map_id"),
+        x=bindparam("character_x"),
+        y=bindparam("character_y"),
+        updated_at=datetime.utcnow()
+    )
+    async with db.session() as session:
+        await session.execute(statement, characters)
+
+
+async def measure(name: str, legacy, fast, arguments: list):
+    for path, query in (("orm", legacy), ("asyncpg", fast)):
+        await query(arguments[0])  # Warms up the connections' statement caches
+        wall_time, cpu_time = time.perf_counter(), time.process_time()
+        for argument in arguments:
+            await query(argument)
+        wall_time, cpu_time = time.perf_counter() - wall_time, time.process_time() - cpu_time
+        print(f"{name:>22} {path:>8}: {wall_time / len(arguments) * 1e6:8.0f} us/query, {cpu_time / len(arguments) * 1e6:8.0f} us CPU/query")
+
+
+async def benchmark(repeat: int, recreate: bool):
+    db = WorldDB()
+    if recreate:
+        await db.recreate_database()
+        await db.populate_database()
+    users = [await db.bootstrap_user(generate_uuid(), "".join(random.choices(string.ascii_letters, k=12))) for _ in range(USERS)]
+    user_ids = [user_id for user_id, _ in users]
+    character_uuids = [character_uuid for _, uuids in users for character_uuid in uuids]
+    names = ["".join(random.choices(string.ascii_letters, k=12)) for _ in range(repeat)]
+    rows = [{"character_uuid": character_uuid, "character_map_id": None, "character_x": random.random() * 1000, "character_y": random.random() * 1000} for character_uuid in character_uuids]
+    db.characters.entries.clear()  # Benchmark the queries rather than the cache
+
+    pick = lambda values: [random.choice(values) for _ in range(repeat)]
+    await measure("location read", lambda uuid: legacy_get_character_location_by_uuid(db, uuid), db.get_character_location_by_uuid, pick(character_uuids))
+    await measure("name exists", lambda name: legacy_check_character_name_exists(db, name), db.check_character_name_exists, names)
+    await measure("character count", lambda user_id: legacy_check_user_has_max_characters(db, user_id), db.check_user_has_max_characters, pick(user_ids))
+    await measure(f"position write ({len(rows)})", lambda rows: legacy_update_characters(db, rows), db.update_characters, [rows] * max(repeat // 20, 1))
+    print(f"pool: {db.pool_stats()}")
+    await db.engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare ORM and raw asyncpg latency of the hot WorldDB queries, needs the DATABASE_SETTINGS database")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--recreate", action="store_true", help="Drop and recreate the database first, like the server does on startup")
+    args = parser.parse_args()
+    asyncio.run(benchmark(args.repeat, args.recreate))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import argparse, asyncio, random, string, time, sqlalchemy.exc
+from common.lib import generate_uuid
+from server.crud import WorldDB
+
+CLIENTS = 200
+
+
+async def legacy_init_user(db: WorldDB, user_uuid: str):
+    # Queries init_user() made before bootstrap_user(), kept for comparison
+    try:
+        user_id = await db.get_user_id_by_uuid(user_uuid)
+    except sqlalchemy.exc.NoResultFound:
+        await db.create_user(user_uuid)
+        user_id = await db.get_user_id_by_uuid(user_uuid)
+    await db.create_character(user_id, {"name": random_name()}, {})
+    character_uuids = await db.get_user_character_uuids(user_id)
+    return user_id, character_uuids
+
+
+async def bootstrap_init_user(db: WorldDB, user_uuid: str):
+    return await db.bootstrap_user(user_uuid, random_name())
+
+
+def random_name() -> str:
+    return "".join(random.choices(string.ascii_letters, k=8))
+
+
+def percentile(values: list, fraction: float) -> float:
+    return sorted(values)[min(int(len(values) * fraction), len(values) - 1)]
+
+
+async def timed(init_user, db: WorldDB, user_uuid: str) -> float:
+    start_time = time.perf_counter()
+    await init_user(db, user_uuid)
+    return time.perf_counter() - start_time
+
+
+async def storm(name: str, init_user, db: WorldDB, user_uuids: list):
+    # Every client connects at once, like after a server restart
+    start_time = time.perf_counter()
+    latencies = await asyncio.gather(*(timed(init_user, db, user_uuid) for user_uuid in user_uuids))
+    elapsed = time.perf_counter() - start_time
+    print(f"{name:>22}: {len(user_uuids) / elapsed:7.0f} users/s, p50 {percentile(latencies, 0.5) * 1e3:7.1f} ms, p99 {percentile(latencies, 0.99) * 1e3:7.1f} ms")
+
+
+async def benchmark(clients: int, recreate: bool):
+    db = WorldDB()
+    if recreate:
+        await db.recreate_database()
+        await db.populate_database()
+    for name, init_user in (("legacy", legacy_init_user), ("bootstrap", bootstrap_init_user)):
+        user_uuids = [generate_uuid() for _ in range(clients)]
+        await storm(name + " (new users)", init_user, db, user_uuids)
+        await storm(name + " (reconnects)", init_user, db, user_uuids)
+        print(f"{'':>22}  pool: {db.pool_stats()}")
+    await db.engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare init_user() database bootstraps under a storm of connecting clients, needs the DATABASE_SETTINGS database")
+    parser.add_argument("--clients", type=int, default=CLIENTS)
+    parser.add_argument("--recreate", action="store_true", help="Drop and recreate the database first, like the server does on startup")
+    args = parser.parse_args()
+    asyncio.run(benchmark(args.clients, args.recreate))
+
+
+if __name__ == "__main__":
+    main()
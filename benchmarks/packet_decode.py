@@ -0,0 +1,50 @@
+import struct, timeit
+from common.lib import NetworkPacket, GameState, PlayerState, SessionEvent, generate_uuid
+
+PLAYERS = 200
+PACKETS_PER_FRAME = 8
+REPEAT = 2000
+
+
+def legacy_unpack(data: bytes) -> NetworkPacket:
+    # Decoder as it was before the memoryview streaming decoder, kept for comparison
+    header_size = struct.calcsize(NetworkPacket.HEADER_FORMAT)
+    header = data[:header_size]
+    packet_type, data_size = struct.unpack(NetworkPacket.HEADER_FORMAT, header)
+    packet_type = NetworkPacket.PacketType(packet_type)
+    payload = data[header_size:header_size + data_size]
+    if packet_type not in NetworkPacket.BINARY_TYPES:
+        payload = payload.decode("utf-8")
+    return NetworkPacket(packet_type, payload)
+
+
+def legacy_unpack_batch(data: bytes) -> list:
+    header_size = struct.calcsize(NetworkPacket.HEADER_FORMAT)
+    packets = []
+    offset = 0
+    while offset < len(data):
+        _, data_size = struct.unpack_from(NetworkPacket.HEADER_FORMAT, data, offset)
+        packets.append(legacy_unpack(data[offset:offset + header_size + data_size]))
+        offset += header_size + data_size
+    return packets
+
+
+def build_frame() -> bytes:
+    player_states = {i + 1: PlayerState(map_id=1, position=(i * 1.5, i * 2.5)) for i in range(PLAYERS)}
+    game_state = GameState(player_states=player_states, snapshot_id=1)
+    session = SessionEvent(SessionEvent.SessionCommand.SCOPE, scope={"characters": [generate_uuid()]})
+    packets = [NetworkPacket(NetworkPacket.PacketType.GAMESTATE, game_state.pack())]
+    packets += [NetworkPacket(NetworkPacket.PacketType.SESSION, session.serialize()) for _ in range(PACKETS_PER_FRAME - 1)]
+    return NetworkPacket.pack_batch(packets)
+
+
+def main():
+    frame = build_frame()
+    print(f"Frame of {PACKETS_PER_FRAME} packets, {len(frame)} bytes, {PLAYERS} players in the game state")
+    for name, decoder in (("legacy", legacy_unpack_batch), ("streaming", NetworkPacket.unpack_batch)):
+        seconds = min(timeit.repeat(lambda: decoder(frame), number=REPEAT, repeat=5))
+        print(f"{name:>10}: {seconds / (REPEAT * PACKETS_PER_FRAME) * 1e9:8.0f} ns/packet")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import argparse, asyncio, sys, time, json, tracemalloc
+from collections import deque
+from datetime import datetime
+from common.lib import NetworkPacket, GameStateCodec
+from server.game_server import GameServer
+from server.recorder import PacketRecorder, RecordKind
+from server.models import Character
+from server.config import SHARD_WORKERS
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class ReplayClient:
+    # Stands in for the WebSocket connection of a recorded client
+    def __init__(self, client_id: int):
+        self.client_id = client_id
+        self.closed = False
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.closed = True
+
+    def __repr__(self):
+        return "ReplayClient({})".format(self.client_id)
+
+
+class ReplayDB:
+    # Answers the queries GameServer makes from the characters in the recording instead of a database
+    def __init__(self, records: list):
+        self.characters = {}  # Mapping of Character UUIDs to the queue of their recorded states, one per login
+        self.names = {}  # Mapping of Character names to UUIDs
+        for kind, _, _, _, payload in records:
+            if kind is RecordKind.CHARACTER:
+                character = json.loads(payload)
+                self.names[character["name"]] = character["uuid"]
+                if "location" in character:
+                    self.characters.setdefault(character["uuid"], deque()).append(character)
+
+    def advance(self, character: dict):
+        # The recorded state was used up by the login that recorded it, later logins get the next one
+        states = self.characters.get(character["uuid"])
+        if states and len(states) > 1 and "location" in character:
+            states.popleft()
+
+    async def get_character_by_uuid(self, character_uuid: str) -> Character:
+        character = self.characters[character_uuid][0]
+        return Character(
+            id=character["id"],
+            uuid=character["uuid"],
+            name=character["name"],
+            created_at=datetime.fromisoformat(character["created_at"]),
+            updated_at=datetime.fromisoformat(character["updated_at"]),
+            map_id=character["location"]["map_id"],
+            x=character["location"]["x"],
+            y=character["location"]["y"]
+        )
+
+    async def get_character_uuid_by_name(self, name: str) -> str:
+        return self.names[name]
+
+    async def check_user_has_max_characters(self, user_id: int) -> bool:
+        return False
+
+    async def check_character_name_exists(self, name: str) -> bool:
+        return False
+
+    async def create_character(self, user_id: int, character_attributes: dict, character_properties: dict):
+        pass
+
+    async def delete_character_by_uuid(self, character_uuid: str):
+        pass
+
+    async def update_characters(self, characters: list):
+        pass
+
+
+def drain(server: GameServer) -> int:
+    # Empties every outbound queue the way push_task() would, returning the bytes it would have sent
+    sent = 0
+    for client in server.clients:
+        outbound_queue = server.queues[client]["outbound_queue"]
+        if not outbound_queue.empty():
+            packets = []
+            while not outbound_queue.empty():
+                packets.append(outbound_queue.get_nowait())
+            sent += len(NetworkPacket.pack_batch(packets))
+    return sent
+
+
+def percentile(values: list, fraction: float) -> float:
+    return sorted(values)[min(int(len(values) * fraction), len(values) - 1)] if values else 0.0
+
+
+async def replay(path: str, trace: bool):
+    if SHARD_WORKERS:
+        raise SystemExit("Replays run the simulation in process, set SHARD_WORKERS = 0")
+    records = list(PacketRecorder.read(path))
+    clock = FakeClock()
+    server = GameServer(auth_mode=False, clock=clock)
+    server.db = ReplayDB(records)
+    clients = {}  # Mapping of recorded client IDs to ReplayClients
+    durations, allocations, tick_bytes = [], [], []
+    total_bytes = 0
+    if trace:
+        tracemalloc.start()
+
+    for kind, client_id, tick, timestamp, payload in records:
+        clock.now = timestamp
+        client = clients.get(client_id)
+        match kind:
+            case RecordKind.CONNECT:
+                client = clients[client_id] = ReplayClient(client_id)
+                server.open_client(client)
+            case RecordKind.USER:
+                user = json.loads(payload)
+                server.users[client].update(id=user["id"], uuid=user["uuid"], characters=set(user["characters"]), codec=GameStateCodec.JSON)
+            case RecordKind.CHARACTER:
+                server.db.advance(json.loads(payload))
+            case RecordKind.PACKET:
+                await server.dispatch_packet(client, NetworkPacket.unpack(payload))
+            case RecordKind.SCHEDULE:
+                # New maps start their schedules here, like they did in the live loop
+                server.simulation.delay(timestamp)
+            case RecordKind.TICK:
+                blocks = sys.getallocatedblocks()
+                start_time = time.perf_counter()
+                server.run_tick(timestamp)
+                durations.append(time.perf_counter() - start_time)
+                allocations.append(sys.getallocatedblocks() - blocks)
+                tick_bytes.append(drain(server))
+            case RecordKind.DISCONNECT:
+                await server.close_client(client)
+                del clients[client_id]
+        total_bytes += drain(server)
+
+    total_bytes += sum(tick_bytes)
+    print(f"Replayed {len(records)} records, {len(durations)} ticks, {max((record[1] for record in records), default=0)} clients")
+    if durations:
+        print(f"Tick time: mean {sum(durations) / len(durations) * 1e3:.3f} ms, p50 {percentile(durations, 0.5) * 1e3:.3f} ms, p99 {percentile(durations, 0.99) * 1e3:.3f} ms, max {max(durations) * 1e3:.3f} ms")
+        print(f"Allocated blocks per tick: mean {sum(allocations) / len(allocations):+.1f}, max {max(allocations):+d}")
+        print(f"Output: {total_bytes} bytes, {sum(tick_bytes) / len(tick_bytes):.0f} bytes per tick")
+    if trace:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"Traced memory: {current / 1024:.0f} KiB current, {peak / 1024:.0f} KiB peak")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a RECORD_PATH recording against a headless GameServer")
+    parser.add_argument("path")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also report traced memory, slows down the replay")
+    args = parser.parse_args()
+    asyncio.run(replay(args.path, args.tracemalloc))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,4 @@
 CLIENT_TICK_HZ = 5
+GAMESTATE_CODECS = ["BINARY", "JSON"]  # GameState codecs offered to the server, in order of preference
+SNAPSHOT_HISTORY = 32  # Received snapshots kept as possible delta baselines
 AUTHENTICATION_SERVER = "http://127.0.0.1:8788"
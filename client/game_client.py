@@ -1,5 +1,7 @@
 import asyncio, websockets, aiohttp, os, time
-from common.lib import NetworkPacket, GameState, SessionEvent, GameSession, MovementEvent
+from collections import OrderedDict
+from typing import Optional, List
+from common.lib import NetworkPacket, GameState, GameStateCodec, MetaInfo, SessionEvent, GameSession, MovementMode, MovementEvent, EntityEvent, SnapshotAck
 from .config import *
 
 
@@ -19,6 +21,10 @@ class GameClient:
         self.credentials = ()
         self.access_token = ""
         self.refresh_token = ""
+        self.codec = GameStateCodec.JSON  # GameState codec negotiated with the server
+        self.movement_mode = MovementMode.POSITION  # Movement mode announced by the server
+        self.input_sequence = 0  # Sequence number of the latest movement input sent to the server
+        self.snapshots = OrderedDict()  # Mapping of snapshot IDs to full GameStates that deltas may be based on
 
         self.delta_time = 1 / CLIENT_TICK_HZ  # Time since last simulation loop
 
@@ -37,8 +43,15 @@ class GameClient:
             if not self.login_event.is_set(): await self.login_event.wait()
             start_time = asyncio.get_running_loop().time()
 
-            if self.mem.local_pos != self.mem.old_local_pos:
-                event = MovementEvent(0, self.mem.local_pos)
+            if self.movement_mode is MovementMode.INPUT:
+                if self.mem.local_keys != self.mem.old_local_keys:
+                    self.input_sequence += 1
+                    event = MovementEvent(self.mem.local_keys, sequence=self.input_sequence)
+                    await asyncio.to_thread(self.mem.queue.put, event)
+                    self.mem.old_local_keys = self.mem.local_keys
+            elif self.mem.local_pos != self.mem.old_local_pos:
+                self.input_sequence += 1
+                event = MovementEvent(0, self.mem.local_pos, sequence=self.input_sequence)
                 await asyncio.to_thread(self.mem.queue.put, event)
                 self.mem.old_local_pos = self.mem.local_pos
 
@@ -75,30 +88,38 @@ class GameClient:
         headers = {"Authorization": f"Bearer {self.access_token}"}
         self.websocket = await websockets.connect(f"ws://{self.host}:{self.port}", extra_headers=headers)
         print("Connected to Game Server!")
+        await self.negotiate()
+
+    async def negotiate(self):
+        meta = MetaInfo(codecs=[GameStateCodec[name].value for name in GAMESTATE_CODECS])
+        packet = NetworkPacket(NetworkPacket.PacketType.META, meta.serialize())
+        await self.outbound_queue.put(packet)
 
     async def disconnect(self):
         await self.websocket.close()
         print("Disconnected from Game Server!")
 
-    async def send(self, packet: NetworkPacket):
-        await self.websocket.send(packet.pack())
+    async def send(self, packets: List[NetworkPacket]):
+        await self.websocket.send(NetworkPacket.pack_batch(packets))
 
-    async def recv(self) -> NetworkPacket:
+    async def recv(self) -> List[NetworkPacket]:
         data = await self.websocket.recv()
-        packet = NetworkPacket.unpack(data)
-        return packet
+        packets = NetworkPacket.unpack_batch(data)
+        return packets
 
     async def pull_task(self):
         while True:
-            packet = await self.recv()
-            # print(f"Received ({packet.type}) message: {packet.payload}")
-            await self.inbound_queue.put(packet)
+            for packet in await self.recv():
+                # print(f"Received ({packet.type}) message: {packet.payload}")
+                await self.inbound_queue.put(packet)
 
     async def push_task(self):
         while True:
-            packet = await self.outbound_queue.get()
-            await self.send(packet)
-            # print(f"Sent ({packet.type}) message: {packet.payload}")
+            packets = [await self.outbound_queue.get()]
+            while not self.outbound_queue.empty():
+                packets.append(self.outbound_queue.get_nowait())
+            await self.send(packets)
+            # print(f"Sent {len(packets)} messages: {[packet.type for packet in packets]}")
 
     async def game_handler(self):
         while True:
@@ -107,25 +128,59 @@ class GameClient:
                 case "SessionEvent":
                     packet = NetworkPacket(NetworkPacket.PacketType.SESSION, event.serialize())
                 case "MovementEvent":
-                    packet = NetworkPacket(NetworkPacket.PacketType.MOVEMENT, event.serialize())
+                    packet = NetworkPacket(NetworkPacket.PacketType.MOVEMENT, event.pack())
             await self.outbound_queue.put(packet)
 
     async def handle_packet(self):
         while True:
             packet = await self.inbound_queue.get()
             match packet.type:
+                case NetworkPacket.PacketType.META:
+                    meta = MetaInfo.deserialize(packet.payload)
+                    await self.handle_meta_event(meta)
                 case NetworkPacket.PacketType.GAMESTATE:
-                    game_state = GameState.deserialize(packet.payload)
-                    await self.handle_gamestate_event(game_state)
+                    game_state = GameState.decode(packet.payload, self.codec)
+                    game_state = self.apply_snapshot(game_state)
+                    if game_state is not None:
+                        await self.handle_gamestate_event(game_state)
                 case NetworkPacket.PacketType.SESSION:
                     event = SessionEvent.deserialize(packet.payload)
                     await self.handle_session_event(event)
+                case NetworkPacket.PacketType.ENTITY:
+                    event = EntityEvent.deserialize(packet.payload)
+                    await self.handle_entity_event(event)
+
+    async def handle_meta_event(self, meta: MetaInfo):
+        codec = meta.kwargs.get("codec")
+        if codec is not None:
+            self.codec = GameStateCodec(codec)
+        movement_mode = meta.kwargs.get("movement_mode")
+        if movement_mode is not None:
+            self.movement_mode = MovementMode(movement_mode)
+
+    def apply_snapshot(self, game_state: GameState) -> Optional[GameState]:
+        if game_state.is_delta:
+            baseline = self.snapshots.get(game_state.baseline_id)
+            if baseline is None:
+                # Without the baseline the delta is useless; not acknowledging it makes the server fall back to a full snapshot
+                return None
+            game_state = game_state.merge(baseline)
+            # The server only diffs against acknowledged snapshots, so nothing older than this baseline is needed anymore
+            while next(iter(self.snapshots)) < baseline.snapshot_id:
+                self.snapshots.popitem(last=False)
+        self.snapshots[game_state.snapshot_id] = game_state
+        while len(self.snapshots) > SNAPSHOT_HISTORY:
+            self.snapshots.popitem(last=False)
+        ack = SnapshotAck(game_state.snapshot_id)
+        self.outbound_queue.put_nowait(NetworkPacket(NetworkPacket.PacketType.ACK, ack.serialize()))
+        return game_state
 
     async def handle_gamestate_event(self, game_state: GameState):
         with self.mem.lock:
             now = time.time()
             self.mem.gs = game_state
-            self.mem.server_pos = game_state.player_states[self.mem.session.character.get("uuid")].position
+            self.mem.server_pos = game_state.player_states[self.mem.session.entity_id].position
+            self.mem.server_input_sequence = game_state.player_states[self.mem.session.entity_id].input_sequence
             self.mem.gamestate_updated_at = now
             self.mem.average_server_dt = (self.mem.average_server_dt + game_state.delta_time) / 2
 
@@ -139,12 +194,17 @@ class GameClient:
                 with self.mem.lock:
                     character = event.kwargs.get("character")
                     self.mem.session.character = character
+                    self.mem.session.entity_id = event.kwargs.get("entity_id")
+                    self.mem.session.entities.clear()
+                    self.snapshots.clear()
                     self.mem.local_pos = character["location"]["x"], character["location"]["y"]
                     self.mem.session.status = GameSession.GameStatus.PLAY
                     self.login_event.set()
             case SessionEvent.SessionCommand.LOGOUT:
                 with self.mem.lock:
                     self.mem.session.character.clear()
+                    self.mem.session.entity_id = None
+                    self.mem.session.entities.clear()
                     self.mem.session.status = GameSession.GameStatus.IDLE
                     self.login_event.clear()
             case SessionEvent.SessionCommand.CREATE:
@@ -155,3 +215,13 @@ class GameClient:
                 with self.mem.lock:
                     character_uuid = event.kwargs.get("character_uuid")
                     self.mem.session.scope["characters"].remove(character_uuid)
+
+    async def handle_entity_event(self, event: EntityEvent):
+        match event.command:
+            case EntityEvent.EntityCommand.SPAWN:
+                with self.mem.lock:
+                    self.mem.session.entities.update(event.entities)
+            case EntityEvent.EntityCommand.DESPAWN:
+                with self.mem.lock:
+                    for entity_id in event.entities:
+                        self.mem.session.entities.pop(entity_id, None)
@@ -1,12 +1,13 @@
 import asyncio, time, json, struct, uuid, hashlib, threading, queue, math, re
 from enum import Enum, auto
-from typing import Iterable, Tuple, Optional, Dict, List
+from typing import Iterable, Iterator, Tuple, Optional, Dict, List, Union
 from collections import deque
 from arcade import key as keycodes
 from pymunk import Vec2d
 
 CLIENT_TICK_HZ = 5
 SERVER_TICK_HZ = 5
+SPRINT_MULTIPLIER = 2.0
 
 
 def generate_uuid() -> str:
@@ -40,7 +41,6 @@ def calculate_distance(pos1: Tuple[float, float], pos2: Tuple[float, float]):
 
 
 def calculate_velocity(movement_keys: int) -> Tuple[float, float]:
-    SPRINT_MULTIPLIER = 2.0
     velocity = Vec2d(0, 0)
 
     if movement_keys & MovementKey.LEFT.value:
@@ -82,6 +82,9 @@ class SharedMemory:
         self.average_server_dt = 1 / SERVER_TICK_HZ
         self.old_local_pos = (0, 0)
         self.local_pos = (0, 0)
+        self.old_local_keys = 0
+        self.local_keys = 0  # Movement keys bitfield currently held by the player
+        self.server_input_sequence = 0  # Latest input sequence the server reported as processed for the local player
         self.local_velocity = (0, 0)
         self.server_pos = (0, 0)
 
@@ -96,6 +99,8 @@ class GameSession:
         self.status = self.GameStatus.IDLE
         self.character = {}  # Dictionary of the Character model
         self.scope = {}  # Scope of permissions, characters, etc. that the user has access to
+        self.entity_id = None  # Entity ID of the logged in character in game states
+        self.entities = {}  # Mapping of entity IDs to the Character UUIDs they stand for
 
 
 class PlayerInput:
@@ -148,35 +153,91 @@ class NetworkPacket:
         SESSION = 3  # SessionEvent()
         MOVEMENT = 4  # MovementEvent()
         CHAT = 5  # ChatEvent()
+        ACK = 6  # SnapshotAck()
+        ENTITY = 7  # EntityEvent()
         UNKNOWN = 255
 
     HEADER_FORMAT = "!BI"
+    HEADER = struct.Struct(HEADER_FORMAT)
+    BINARY_TYPES = (PacketType.GAMESTATE, PacketType.MOVEMENT)  # Packet types whose payload is handed over undecoded, as a memoryview into the frame
+    PACKET_TYPES = {packet_type.value: packet_type for packet_type in PacketType}  # Avoids the Enum lookup machinery per packet
 
-    def __init__(self, packet_type: PacketType, data: str):
+    def __init__(self, packet_type: PacketType, data: Union[str, bytes, memoryview]):
         self.type = packet_type
         self.payload = data
+        self.packed = None  # Cached wire representation, so a packet shared by many clients is only framed once
 
     def pack(self) -> bytes:
-        data = self.encode(self.payload)
-        header = struct.pack(self.HEADER_FORMAT, self.type.value, len(data))
-        packet = header + data
-        return packet
+        if self.packed is None:
+            data = self.encode(self.payload)
+            self.packed = self.HEADER.pack(self.type.value, len(data)) + data
+        return self.packed
 
     @classmethod
-    def unpack(cls, data: bytes) -> "NetworkPacket":
-        header_size = struct.calcsize(cls.HEADER_FORMAT)
-        header = data[:header_size]
-        packet_type, data_size = struct.unpack(cls.HEADER_FORMAT, header)
-        payload = cls.decode(data[header_size:header_size + data_size])
-        return cls(cls.PacketType(packet_type), payload)
+    def unpack(cls, data: Union[bytes, memoryview]) -> "NetworkPacket":
+        return next(cls.iter_unpack(data))
 
     @staticmethod
-    def encode(data: str) -> bytes:
+    def pack_batch(packets: Iterable["NetworkPacket"]) -> bytes:
+        # Every packet carries its own length in its header, so a frame can simply hold several of them back to back
+        return b"".join(packet.pack() for packet in packets)
+
+    @classmethod
+    def unpack_batch(cls, data: Union[bytes, memoryview]) -> List["NetworkPacket"]:
+        return list(cls.iter_unpack(data))
+
+    @classmethod
+    def iter_unpack(cls, data: Union[bytes, memoryview]) -> Iterator["NetworkPacket"]:
+        view = memoryview(data)
+        header_size = cls.HEADER.size
+        offset = 0
+        while offset < len(view):
+            packet_type, data_size = cls.HEADER.unpack_from(view, offset)
+            offset += header_size
+            if offset + data_size > len(view):
+                raise struct.error("Truncated packet: expected {} bytes of payload, got {}".format(data_size, len(view) - offset))
+            packet_type = cls.PACKET_TYPES.get(packet_type, cls.PacketType.UNKNOWN)
+            payload = view[offset:offset + data_size]
+            if packet_type not in cls.BINARY_TYPES:
+                payload = cls.decode(payload)
+            offset += data_size
+            yield cls(packet_type, payload)
+
+    @staticmethod
+    def encode(data: Union[str, bytes, memoryview]) -> bytes:
+        if isinstance(data, (bytes, memoryview)):
+            return data
         return data.encode("utf-8")
 
     @staticmethod
-    def decode(data: bytes) -> str:
-        return data.decode("utf-8")
+    def decode(data: Union[bytes, memoryview]) -> str:
+        return str(data, "utf-8")
+
+
+class GameStateCodec(Enum):
+    JSON = 0  # Human-readable fallback, useful for debugging
+    BINARY = 1  # Fixed-layout struct encoding
+
+
+class MovementMode(Enum):
+    POSITION = 0  # Clients report absolute positions
+    INPUT = 1  # Clients report sequence-numbered input bitfields and the server simulates movement
+
+
+class MetaInfo:
+    def __init__(self, **meta_kwargs):
+        self.kwargs = meta_kwargs
+
+    def __repr__(self):
+        return "MetaInfo({})".format(self.kwargs)
+
+    def serialize(self) -> str:
+        return json.dumps(self.kwargs)
+
+    @classmethod
+    def deserialize(cls, meta: str) -> "MetaInfo":
+        meta_kwargs = json.loads(meta)
+        return cls(**meta_kwargs)
 
 
 class SessionEvent:
@@ -262,20 +323,71 @@ class MovementKey(Enum):
 
 
 class MovementEvent:
-    def __init__(self, movement_keys: int, position: Tuple[float, float]):
+
+    PACKED_INPUT = struct.Struct("!IB")  # sequence, movement keys
+    PACKED_POSITION = struct.Struct("!ff")  # Absolute position, only sent in MovementMode.POSITION
+    PACKED_SIZES = (PACKED_INPUT.size, PACKED_INPUT.size + PACKED_POSITION.size)  # Valid payload sizes, without and with a position
+
+    def __init__(self, movement_keys: int, position: Optional[Tuple[float, float]] = None, sequence: int = 0):
         self.keys = movement_keys
         self.position = position
+        self.sequence = sequence
+
+    def pack(self) -> bytes:
+        data = self.PACKED_INPUT.pack(self.sequence, self.keys)
+        if self.position is not None:
+            data += self.PACKED_POSITION.pack(*self.position)
+        return data
+
+    @classmethod
+    def unpack(cls, data: Union[bytes, memoryview]) -> "MovementEvent":
+        sequence, movement_keys = cls.PACKED_INPUT.unpack_from(data)
+        position = None
+        if len(data) >= cls.PACKED_INPUT.size + cls.PACKED_POSITION.size:
+            position = cls.PACKED_POSITION.unpack_from(data, cls.PACKED_INPUT.size)
+        return cls(movement_keys, position, sequence)
+
+
+class EntityEvent:
+
+    class EntityCommand(Enum):
+        SPAWN = 0
+        DESPAWN = 1
+
+    def __init__(self, entity_command: EntityCommand, entities: Dict[int, str]):
+        self.command = entity_command
+        self.entities = entities  # Mapping of entity IDs to Character UUIDs
+
+    def __repr__(self):
+        return "EntityEvent({}, {})".format(self.command, self.entities)
 
     def serialize(self) -> str:
         return json.dumps({
-            "keys": self.keys,
-            "position": self.position
+            "command": self.command.value,
+            "entities": self.entities
         })
 
     @classmethod
-    def deserialize(cls, event: str) -> "MovementEvent":
+    def deserialize(cls, event: str) -> "EntityEvent":
         event = json.loads(event)
-        return cls(event["keys"], event["position"])
+        entity_command = cls.EntityCommand(event["command"])
+        entities = {int(entity_id): character_uuid for entity_id, character_uuid in event["entities"].items()}
+        return cls(entity_command, entities)
+
+
+class SnapshotAck:
+    def __init__(self, snapshot_id: int):
+        self.snapshot_id = snapshot_id
+
+    def serialize(self) -> str:
+        return json.dumps({
+            "snapshot_id": self.snapshot_id
+        })
+
+    @classmethod
+    def deserialize(cls, ack: str) -> "SnapshotAck":
+        ack = json.loads(ack)
+        return cls(ack["snapshot_id"])
 
 
 class ChatChannel(Enum):
@@ -291,32 +403,104 @@ class ChatEvent:
 
 
 class GameState:
+
+    PACKED_HEADER = struct.Struct("!IIfHH")  # snapshot_id, baseline_id, delta_time, number of player states, number of removals
+    PACKED_KEY = struct.Struct("!H")  # Entity ID
+
     def __init__(self, **kwargs):
-        self.player_states = kwargs.get("player_states", {}) # Dictionary of Character UUIDs to PlayerState instances
+        self.player_states = kwargs.get("player_states", {}) # Dictionary of entity IDs to PlayerState instances
         self.delta_time = kwargs.get("delta_time", 1 / SERVER_TICK_HZ) # Time since last game state
+        self.snapshot_id = kwargs.get("snapshot_id", 0)  # Sequence number the client acknowledges
+        self.baseline_id = kwargs.get("baseline_id")  # Snapshot this one is a delta against, None for a full snapshot
+        self.removed = kwargs.get("removed", [])  # Entity IDs present in the baseline but not anymore
+
+    @property
+    def is_delta(self) -> bool:
+        return self.baseline_id is not None
 
     def to_dict(self) -> dict:
         return {
-            "player_states": {k: v.serialize() for k, v in self.player_states.items()},
-            "delta_time": self.delta_time
+            "player_states": {k: v.to_dict() for k, v in self.player_states.items()},
+            "delta_time": self.delta_time,
+            "snapshot_id": self.snapshot_id,
+            "baseline_id": self.baseline_id,
+            "removed": self.removed
         }
 
     def serialize(self) -> str:
         return json.dumps(self.to_dict())
 
     @classmethod
-    def deserialize(cls, game_state: str) -> "GameState":
+    def deserialize(cls, game_state: Union[str, bytes]) -> "GameState":
         kwargs = json.loads(game_state)
-        kwargs["player_states"] = {k: PlayerState.deserialize(v) for k, v in kwargs["player_states"].items()}
+        kwargs["player_states"] = {int(k): PlayerState(**v) for k, v in kwargs["player_states"].items()}
         return cls(**kwargs)
 
+    def pack(self) -> bytes:
+        entries = b"".join(self.pack_entry(entity_id, player) for entity_id, player in self.player_states.items())
+        return self.pack_entries(entries, len(self.player_states), self.removed, snapshot_id=self.snapshot_id, baseline_id=self.baseline_id, delta_time=self.delta_time)
+
+    @classmethod
+    def pack_entry(cls, entity_id: int, player: "PlayerState") -> bytes:
+        return cls.PACKED_KEY.pack(entity_id) + player.pack()
+
+    @classmethod
+    def pack_entries(cls, entries: bytes, entry_count: int, removed: List[int], **kwargs) -> bytes:
+        # Assembles a packed GameState from already packed player entries, e.g. a whole array of them encoded at once
+        header = cls.PACKED_HEADER.pack(kwargs.get("snapshot_id", 0), kwargs.get("baseline_id") or 0, kwargs.get("delta_time", 1 / SERVER_TICK_HZ), entry_count, len(removed))
+        return b"".join([header, entries, *(cls.PACKED_KEY.pack(entity_id) for entity_id in removed)])
+
+    @classmethod
+    def unpack(cls, data: Union[bytes, memoryview]) -> "GameState":
+        snapshot_id, baseline_id, delta_time, player_count, removed_count = cls.PACKED_HEADER.unpack_from(data)
+        offset = cls.PACKED_HEADER.size
+        player_states = {}
+        for _ in range(player_count):
+            entity_id, = cls.PACKED_KEY.unpack_from(data, offset)
+            offset += cls.PACKED_KEY.size
+            player_states[entity_id] = PlayerState.unpack(data, offset)
+            offset += PlayerState.PACKED_FORMAT.size
+        removed = []
+        for _ in range(removed_count):
+            entity_id, = cls.PACKED_KEY.unpack_from(data, offset)
+            offset += cls.PACKED_KEY.size
+            removed.append(entity_id)
+        return cls(player_states=player_states, delta_time=delta_time, snapshot_id=snapshot_id, baseline_id=baseline_id or None, removed=removed)
+
+    def merge(self, baseline: "GameState") -> "GameState":
+        player_states = dict(baseline.player_states)
+        player_states.update(self.player_states)
+        for entity_id in self.removed:
+            player_states.pop(entity_id, None)
+        return GameState(player_states=player_states, delta_time=self.delta_time, snapshot_id=self.snapshot_id)
+
+    def encode(self, codec: GameStateCodec) -> Union[str, bytes]:
+        match codec:
+            case GameStateCodec.BINARY:
+                return self.pack()
+            case _:
+                return self.serialize()
+
+    @classmethod
+    def decode(cls, game_state: Union[bytes, memoryview], codec: GameStateCodec) -> "GameState":
+        match codec:
+            case GameStateCodec.BINARY:
+                return cls.unpack(game_state)
+            case _:
+                return cls.deserialize(bytes(game_state))
+
 
 class PlayerState:
+
+    PACKED_FORMAT = struct.Struct("!IffHId")  # map_id, x, y, travel_speed, input_sequence, updated_at
+
     def __init__(self, **kwargs):
         self.map_id = kwargs.get("map_id", 0)
         self.position = kwargs.get("position", (0, 0))
         self.z_index = kwargs.get("z_index", 1)
         self.travel_speed = kwargs.get("travel_speed", 200)
+        self.velocity = kwargs.get("velocity", (0, 0))  # Derived from the latest movement keys, not replicated
+        self.input_sequence = kwargs.get("input_sequence", 0)  # Sequence number of the latest movement input the server processed
         self.updated_at = kwargs.get("updated_at", time.time())
 
     def to_dict(self) -> dict:
@@ -324,6 +508,7 @@ class PlayerState:
             "map_id": self.map_id,
             "position": self.position,
             "travel_speed": self.travel_speed,
+            "input_sequence": self.input_sequence,
             "updated_at": self.updated_at
         }
 
@@ -337,6 +522,14 @@ class PlayerState:
             kwargs[k] = v
         return cls(**kwargs)
 
+    def pack(self) -> bytes:
+        return self.PACKED_FORMAT.pack(self.map_id or 0, self.position[0], self.position[1], self.travel_speed, self.input_sequence, self.updated_at)
+
+    @classmethod
+    def unpack(cls, data: Union[bytes, memoryview], offset: int = 0) -> "PlayerState":
+        map_id, x, y, travel_speed, input_sequence, updated_at = cls.PACKED_FORMAT.unpack_from(data, offset)
+        return cls(map_id=map_id, position=(x, y), travel_speed=travel_speed, input_sequence=input_sequence, updated_at=updated_at)
+
 
 class ActorSprite(Enum):
     RED_CIRCLE = 0
@@ -0,0 +1,22 @@
+import argparse, os
+from server.collision import CollisionGrid
+from server.config import COLLISION_DIR, COLLISION_LAYER, COLLISION_SCALING
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the collision layer of a TMX tile map into the grid the server checks movement against")
+    parser.add_argument("tmx_path")
+    parser.add_argument("map_id", type=int, help="Map.id the tile map is used for")
+    parser.add_argument("--layer", default=COLLISION_LAYER)
+    parser.add_argument("--scaling", type=float, default=COLLISION_SCALING)
+    parser.add_argument("--output-dir", default=COLLISION_DIR)
+    args = parser.parse_args()
+
+    grid = CollisionGrid.compile(args.tmx_path, args.layer, args.scaling)
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, "{}.bin".format(args.map_id))
+    grid.save(path)
+    print(f"[{CollisionGrid.__name__}] Compiled {grid.width}x{grid.height} tiles of \"{args.layer}\" to {path}")
+
+if __name__ == "__main__":
+    main()
@@ -39,8 +39,8 @@ class GameView(arcade.View):
         self.scene.draw_hit_boxes(color=arcade.color.RED, line_thickness=1)
         self.player_sprite.draw_hit_box(color=arcade.color.RED, line_thickness=1)
         if self.mem.session.status == GameSession.GameStatus.PLAY:
-            for character_uuid, player in self.mem.gs.player_states.items():
-                if character_uuid != self.mem.session.character.get("uuid"):
+            for entity_id, player in self.mem.gs.player_states.items():
+                if entity_id != self.mem.session.entity_id:
                     arcade.draw_circle_filled(player.position[0], player.position[1], self.p_radius, arcade.color.BLUE)
 
     def on_update(self, delta_time: float):
@@ -68,7 +68,8 @@ class GameView(arcade.View):
                 self.update_player_movement()
 
     def update_player_movement(self):
-        velocity = calculate_velocity(self.player_input.to_bitfield())
+        self.mem.local_keys = self.player_input.to_bitfield()
+        velocity = calculate_velocity(self.mem.local_keys)
         self.player_sprite.change_x, self.player_sprite.change_y = velocity
 
     def camera_to_player(self):
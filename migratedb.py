@@ -0,0 +1,12 @@
+import asyncio
+from server.crud import WorldDB
+
+
+async def main():
+    db = WorldDB()
+    await db.migrate_database()
+    await db.engine.dispose()
+    print(f"[{WorldDB.__name__}] Migrated the database to the current schema")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,46 @@
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUCache:
+    MISSING = object()  # Returned by get() for keys that are not cached, as None may be a cached value
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # Least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Any:
+        value = self.entries.get(key, self.MISSING)
+        if value is self.MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def peek(self, key: Hashable) -> Any:
+        # Lookup for writers keeping entries up to date, which neither counts nor refreshes the entry
+        return self.entries.get(key, self.MISSING)
+
+    def invalidate(self, key: Hashable):
+        self.entries.pop(key, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions
+        }
@@ -0,0 +1,137 @@
+import os, struct, base64, gzip, zlib
+import numpy as np
+import xml.etree.ElementTree as ET
+from typing import Optional, Tuple
+
+
+class CollisionGrid:
+    # Bitmap of solid tiles, one bit per tile with row 0 at the bottom of the map like arcade's y axis
+
+    HEADER = struct.Struct("!4sHIIff")  # magic, version, width and height in tiles, tile width and height in world units
+    MAGIC = b"EDOC"
+    VERSION = 1
+    GID_MASK = 0x0FFFFFFF  # Strips Tiled's flip and rotation flags from tile GIDs
+    REFINE_STEPS = 8  # Bisections locating a wall between two samples, half a tile / 2 ** 8 is well under a pixel
+
+    def __init__(self, bitmap: np.ndarray, width: int, height: int, tile_width: float, tile_height: float, hit_box: Tuple[float, float, float, float] = (0, 0, 0, 0)):
+        self.bitmap = bitmap  # (height, ceil(width / 8)) uint8 array as returned by np.packbits
+        self.width = width
+        self.height = height
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.hit_box = hit_box  # left, bottom, right, top of the player's hit box relative to its position
+        # Points of the hit box tested against the bitmap, no further apart than a tile so no wall fits between them
+        left, bottom, right, top = hit_box
+        columns = np.linspace(left, right, int(np.ceil((right - left) / tile_width)) + 1)
+        rows = np.linspace(bottom, top, int(np.ceil((top - bottom) / tile_height)) + 1)
+        self.hit_box_points = np.stack(np.meshgrid(columns, rows), axis=-1).reshape(-1, 2)
+
+    @classmethod
+    def compile(cls, tmx_path: str, layer_name: str, scaling: float) -> "CollisionGrid":
+        # Any non-empty tile in the layer is solid over its whole cell, the client collides against the hit box of the tile's texture instead
+        root = ET.parse(tmx_path).getroot()
+        if root.get("infinite") == "1":
+            raise ValueError("Infinite maps are not supported, export {} as a fixed size map".format(tmx_path))
+        width, height = int(root.get("width")), int(root.get("height"))
+        layer = root.find("./layer[@name='{}']".format(layer_name))
+        if layer is None:
+            raise ValueError("No layer named \"{}\" in {}".format(layer_name, tmx_path))
+
+        data = layer.find("data")
+        match data.get("encoding"):
+            case "csv":
+                gids = np.array([int(gid) for gid in data.text.replace("\n", "").split(",")], dtype=np.uint32)
+            case "base64":
+                raw = base64.b64decode(data.text.strip())
+                match data.get("compression"):
+                    case "zlib":
+                        raw = zlib.decompress(raw)
+                    case "gzip":
+                        raw = gzip.decompress(raw)
+                    case None:
+                        pass
+                    case compression:
+                        raise ValueError("Unsupported layer compression: {}".format(compression))
+                gids = np.frombuffer(raw, dtype="<u4")
+            case None:
+                gids = np.array([int(tile.get("gid", 0)) for tile in data.iter("tile")], dtype=np.uint32)
+            case encoding:
+                raise ValueError("Unsupported layer encoding: {}".format(encoding))
+
+        solid = (gids.reshape(height, width) & cls.GID_MASK) != 0
+        bitmap = np.packbits(solid[::-1], axis=1)
+        return cls(bitmap, width, height, int(root.get("tilewidth")) * scaling, int(root.get("tileheight")) * scaling)
+
+    def save(self, path: str):
+        with open(path, "wb") as file:
+            file.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.width, self.height, self.tile_width, self.tile_height))
+            file.write(self.bitmap.tobytes())
+
+    @classmethod
+    def load(cls, path: str, hit_box: Tuple[float, float, float, float] = (0, 0, 0, 0)) -> "CollisionGrid":
+        with open(path, "rb") as file:
+            magic, version, width, height, tile_width, tile_height = cls.HEADER.unpack(file.read(cls.HEADER.size))
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError("{} is not a version {} collision grid, recompile it".format(path, cls.VERSION))
+        bitmap = np.memmap(path, dtype=np.uint8, mode="r", offset=cls.HEADER.size, shape=(height, (width + 7) // 8))
+        return cls(bitmap, width, height, tile_width, tile_height, hit_box)
+
+    def solid(self, points: np.ndarray) -> np.ndarray:
+        # Vectorized lookup of points shaped (..., 2), outside the map counts as open like it does on the client
+        columns = np.floor(points[..., 0] / self.tile_width).astype(np.int64)
+        rows = np.floor(points[..., 1] / self.tile_height).astype(np.int64)
+        inside = (columns >= 0) & (columns < self.width) & (rows >= 0) & (rows < self.height)
+        columns = np.clip(columns, 0, self.width - 1)
+        rows = np.clip(rows, 0, self.height - 1)
+        bits = (self.bitmap[rows, columns >> 3] >> (7 - (columns & 7))) & 1
+        return inside & (bits == 1)
+
+    def blocked(self, positions: np.ndarray) -> np.ndarray:
+        # Whether the hit box at each position shaped (..., 2) overlaps a solid tile
+        return self.solid(positions[..., np.newaxis, :] + self.hit_box_points).any(axis=-1)
+
+    def segment(self, start: np.ndarray, end: np.ndarray) -> np.ndarray:
+        # Moves every hit box from its start position towards its end position, stopping just before the first wall in the way
+        length = np.sqrt(((end - start) ** 2).sum(axis=1)).max(initial=0)
+        steps = int(np.ceil(length / (min(self.tile_width, self.tile_height) / 2))) + 1
+        if steps < 2:
+            return end
+        t = np.linspace(0, 1, steps)
+        direction = end - start
+        blocked = self.blocked(start[:, np.newaxis, :] + direction[:, np.newaxis, :] * t[np.newaxis, :, np.newaxis])
+        # Players already inside a wall may move freely so they can't get stuck in it
+        hit = np.flatnonzero(blocked.any(axis=1) & ~blocked[:, 0])
+        result = end.copy()
+        if len(hit) == 0:
+            return result
+        first_blocked = blocked[hit].argmax(axis=1)
+        low, high = t[first_blocked - 1], t[first_blocked]
+        # Bisect between the last open and the first blocked sample to stop flush against the wall
+        for _ in range(self.REFINE_STEPS):
+            middle = (low + high) / 2
+            solid = self.blocked(start[hit] + direction[hit] * middle[:, np.newaxis])
+            high = np.where(solid, middle, high)
+            low = np.where(solid, low, middle)
+        result[hit] = start[hit] + direction[hit] * low[:, np.newaxis]
+        return result
+
+    def clamp(self, start: np.ndarray, end: np.ndarray) -> np.ndarray:
+        # Resolves x before y like arcade.PhysicsEngineSimple, so players slide along walls
+        # Close to the client but not exact: the hit box is an axis-aligned COLLISION_HIT_BOX and tiles are solid over their whole cell
+        horizontal = self.segment(start, np.column_stack((end[:, 0], start[:, 1])))
+        return self.segment(horizontal, np.column_stack((horizontal[:, 0], end[:, 1])))
+
+
+class CollisionMaps:
+    def __init__(self, directory: str, hit_box: Tuple[float, float, float, float]):
+        self.directory = directory
+        self.hit_box = hit_box
+        self.grids = {}  # Mapping of Map IDs to their memory-mapped CollisionGrid, or None for maps that were not compiled
+
+    def get(self, map_id: Optional[int]) -> Optional[CollisionGrid]:
+        if map_id is None:
+            return None
+        if map_id not in self.grids:
+            path = os.path.join(self.directory, "{}.bin".format(map_id))
+            self.grids[map_id] = CollisionGrid.load(path, self.hit_box) if os.path.exists(path) else None
+        return self.grids[map_id]
@@ -1,5 +1,35 @@
 SERVER_TICK_HZ = 5
-DATABASE_SYNC_HZ = 0.01
+DATABASE_SYNC_HZ = 0.01  # Flushes per second of every online Character's location to the database
+DATABASE_SYNC_CHUNK_SIZE = 1000  # Characters written per executemany batch within a flush
+MAP_TICK_HZ = {}  # Mapping of Map IDs to their own simulation rate, maps not listed tick at SERVER_TICK_HZ
+MAX_CATCH_UP_STEPS = 5  # Overdue simulation steps run back to back after a stall before the rest are skipped
+TICK_HISTOGRAM_BOUNDS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0]  # Bucket upper bounds in seconds of the tick duration and lateness histograms
+SHARD_WORKERS = 0  # Worker processes simulating the maps with map_id % SHARD_WORKERS equal to their index, 0 simulates every map in the server process
+SHARD_RING_SIZE = 4 * 1024 * 1024  # Bytes of each shared-memory ring buffer between the server and a shard
+SHARD_POLL_INTERVAL = 0.002  # Seconds between polls of the shard ring buffers
+COLLISION_DIR = "maps/collision"  # Compiled collision grids named <Map.id>.bin, see compilemaps.py; maps without one are not collision checked
+COLLISION_LAYER = "Tile Layer 2"  # TMX layer whose tiles are walls, the one the client puts in a spatial hash
+COLLISION_SCALING = 3  # Tile map scaling used by the client
+COLLISION_HIT_BOX = (-30, -62, 30, -34)  # Left, bottom, right, top of the player's hit box relative to its position, the feet box game_window.py set on the scale 2 sprite; keep in sync with the client's sprite
+POSITION_HISTORY = 32  # Ticks of positions kept per player for lag compensation and rewind queries
+RECORD_PATH = None  # File every inbound packet is recorded to for benchmarks/replay.py, None disables recording
+BROADCAST_STATS_SIZE = 300  # Number of ticks whose game state fan-out duration is kept
+MAX_ENTITY_ID = 65535  # Entity IDs are packed as unsigned shorts in game states
+SNAPSHOT_HISTORY = 32  # Snapshots kept per map as delta baselines before a client falls back to a full snapshot
+VIEW_RADIUS = 1280  # Distance within which players are replicated to each other, None replicates the whole map
+VIEW_HYSTERESIS = 128  # Extra distance before a player in view drops out of it again, so players at the edge don't flicker
+INTEREST_CELL_SIZE = 512  # Side length of the spatial grid cells used to look up nearby players
+OUTBOUND_QUEUE_SIZE = 64  # Backlog budget of unsent packets per client
+OUTBOUND_BACKLOG_TIMEOUT = 10  # Seconds a client may stay over its backlog budget before it is disconnected
+MOVEMENT_MODE = "POSITION"  # "POSITION" validates the positions clients report every tick, "INPUT" simulates movement from client inputs on the server and needs a client that predicts and reconciles, which this one does not yet
+MOVEMENT_PACKET_RATE = 30  # Sustained MOVEMENT packets per second accepted from a client, the rest are dropped undecoded
+MOVEMENT_PACKET_BURST = 10  # MOVEMENT packets a client may send back to back before MOVEMENT_PACKET_RATE applies
+MOVEMENT_TOLERANCE = 1.25  # Slack on top of travel_speed * SPRINT_MULTIPLIER * elapsed time before a reported move counts as a violation
+MOVEMENT_BURST = 0.5  # Most seconds of movement a single reported position may cover, so players can't bank distance by standing still; ticks simulating longer than this allow their own length
+MOVEMENT_VIOLATION = "CLAMP"  # "CLAMP" shortens violating moves to the allowed distance, "ROLLBACK" rejects them
+MOVEMENT_STRIKE_LIMIT = 5  # Violations after which a player is reported for abuse
+MOVEMENT_STRIKE_DECAY = 0.5  # Violations forgiven per second
+GAMESTATE_CODECS = ["BINARY", "JSON"]  # Supported GameState codecs, first match in the client's offer wins
 AUTHENTICATION_SERVER = "http://127.0.0.1:8788"
 DATABASE_SETTINGS = {
         "drivername": "postgresql+asyncpg",
@@ -8,6 +38,13 @@ DATABASE_SETTINGS = {
         "port": 5432,
         "database": "world"
 }
+DATABASE_ECHO = False  # Logs every SQL statement, only for debugging
+DATABASE_POOL_SIZE = 10  # Connections kept open to the database
+DATABASE_MAX_OVERFLOW = 20  # Extra connections opened under load on top of DATABASE_POOL_SIZE
+DATABASE_POOL_TIMEOUT = 30  # Seconds to wait for a connection once DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW are checked out
+DATABASE_POOL_PRE_PING = True  # Tests connections on checkout, so ones the database dropped are replaced instead of failing a query
+DATABASE_STATEMENT_CACHE_SIZE = 500  # Prepared statements cached per connection
+DATABASE_CACHE_SIZE = 4096  # Characters cached in memory before the least recently used are evicted
 IRC_CAPABILITIES = {
         "sasl": {
                 "required_version": None,
@@ -1,28 +1,71 @@
-import asyncio, traceback
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+import traceback
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.engine import URL
-from sqlalchemy.orm import sessionmaker, selectinload
+from sqlalchemy.orm import selectinload
 from sqlalchemy.future import select
+import sqlalchemy.exc
+from sqlalchemy import insert, update, event, literal, union_all, text
+from sqlalchemy.dialects.postgresql import insert as upsert
 from contextlib import asynccontextmanager
+from datetime import datetime
 from typing import List, Tuple
+from common.lib import generate_uuid
 from .models import *
-from .config import DATABASE_SETTINGS
+from .cache import LRUCache
+from .config import DATABASE_SETTINGS, DATABASE_SYNC_CHUNK_SIZE, DATABASE_ECHO, DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW, DATABASE_POOL_TIMEOUT, DATABASE_POOL_PRE_PING, DATABASE_STATEMENT_CACHE_SIZE, DATABASE_CACHE_SIZE
 
 DATABASE_URI = URL.create(**DATABASE_SETTINGS)
 
+# Hot queries run straight on the asyncpg connection, which prepares each once per connection and returns plain records
+SELECT_LOCATION = "SELECT map_id, x, y FROM characters WHERE uuid = $1"
+SELECT_NAME_EXISTS = "SELECT EXISTS (SELECT 1 FROM characters WHERE name = $1)"
+SELECT_HAS_MAX_CHARACTERS = "SELECT character_count >= max_characters FROM users WHERE id = $1"
+UPDATE_LOCATION = "UPDATE characters SET map_id = $2, x = $3, y = $4, updated_at = $5 WHERE uuid = $1"
+
 
 class WorldDB:
     def __init__(self):
-        self.engine = create_async_engine(DATABASE_URI, echo=True)
-
-    def async_session_generator(self):
-        return sessionmaker(self.engine, expire_on_commit=False, class_=AsyncSession)
+        self.engine = create_async_engine(
+            DATABASE_URI,
+            echo=DATABASE_ECHO,
+            pool_size=DATABASE_POOL_SIZE,
+            max_overflow=DATABASE_MAX_OVERFLOW,
+            pool_timeout=DATABASE_POOL_TIMEOUT,
+            pool_pre_ping=DATABASE_POOL_PRE_PING,
+            connect_args={"prepared_statement_cache_size": DATABASE_STATEMENT_CACHE_SIZE}  # Per-connection LRU of asyncpg prepared statements, so hot queries are parsed and planned once
+        )
+        self.async_session = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.peak_checked_out = 0
+        self.saturated_checkouts = 0  # Checkouts that took the last connection the pool may open, later ones wait up to DATABASE_POOL_TIMEOUT
+        event.listen(self.engine.sync_engine, "checkout", self.on_checkout)
+        # Read-through cache kept up to date by the writes below, which are the only ones to these rows
+        self.characters = LRUCache(DATABASE_CACHE_SIZE)  # Mapping of Character UUIDs to detached Characters
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        checked_out = self.engine.pool.checkedout()
+        self.peak_checked_out = max(self.peak_checked_out, checked_out)
+        if checked_out >= DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW:
+            self.saturated_checkouts += 1
+
+    def pool_stats(self) -> dict:
+        checked_out = self.engine.pool.checkedout()
+        return {
+            "checked_out": checked_out,
+            "idle": self.engine.pool.checkedin(),
+            "overflow": max(self.engine.pool.overflow(), 0),
+            "utilization": checked_out / (DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW),
+            "peak_checked_out": self.peak_checked_out,
+            "saturated_checkouts": self.saturated_checkouts
+        }
+
+    def cache_stats(self) -> dict:
+        return {
+            "characters": self.characters.stats()
+        }
 
     @asynccontextmanager
     async def session(self):
-        async_session = self.async_session_generator()
-
-        async with async_session() as session:
+        async with self.async_session() as session:
             try:
                 yield session
                 await session.commit()
@@ -33,11 +76,26 @@ class WorldDB:
             finally:
                 await session.close()
 
+    @asynccontextmanager
+    async def connection(self):
+        # Raw asyncpg connection checked out of the same pool as sessions, for the hot queries that skip the ORM
+        async with self.engine.connect() as connection:
+            raw_connection = await connection.get_raw_connection()
+            yield raw_connection.driver_connection
+
     async def recreate_database(self):
         async with self.engine.begin() as conn:
             await conn.run_sync(Base.metadata.drop_all)
             await conn.run_sync(Base.metadata.create_all)
 
+    async def migrate_database(self):
+        # Brings a database created by an older version up to the current schema, safe to run again; run it while the server is stopped
+        async with self.engine.begin() as conn:
+            await conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS character_count INTEGER NOT NULL DEFAULT 0"))
+            await conn.execute(text("UPDATE users SET character_count = (SELECT count(*) FROM characters WHERE characters.user_id = users.id AND characters.is_deleted = false)"))
+            for index in Character.__table__.indexes:
+                await conn.run_sync(index.create, checkfirst=True)
+
     async def populate_database(self):
         async with self.session() as session:
             map = Map(name="Placeholder Map")
@@ -57,6 +115,31 @@ class WorldDB:
                 user_id=user_id
             )
             session.add(character)
+            await session.execute(update(User).where(User.id == user_id).values(character_count=User.character_count + 1))
+        self.characters.put(character.uuid, character)
+
+    async def bootstrap_user(self, user_uuid: str, character_name: str) -> Tuple[int, List[str]]:
+        # Upserts the User, creates a Character for it and lists all its Characters in a single statement and round trip
+        users, characters = User.__table__, Character.__table__
+        created_at = datetime.utcnow()
+        # Column defaults are not applied to inserts inside a CTE, so max_characters is passed explicitly
+        insert_user = upsert(users).values(uuid=user_uuid, max_characters=User.max_characters.default.arg, character_count=1)
+        # Counting the new Character in the upsert also makes RETURNING yield the ID of an existing User, which DO NOTHING would not
+        user = insert_user.on_conflict_do_update(index_elements=[users.c.uuid], set_={"character_count": users.c.character_count + 1}).returning(users.c.id).cte("bootstrapped_user")
+        character = insert(characters).from_select(
+            ["uuid", "name", "user_id", "created_at", "updated_at", "is_deleted", "x", "y"],
+            select(literal(generate_uuid()), literal(character_name), user.c.id, literal(created_at), literal(created_at), literal(False), literal(0.0), literal(0.0))
+        ).returning(characters.c.user_id, characters.c.uuid).cte("created_character")
+        # Sibling CTEs run against the same snapshot, so the new Character comes from RETURNING rather than the join
+        statement = union_all(
+            select(user.c.id, characters.c.uuid).select_from(user.join(characters, characters.c.user_id == user.c.id)),
+            select(character.c.user_id, character.c.uuid)
+        )
+        async with self.session() as session:
+            result = await session.execute(statement)
+            rows = result.all()
+        user_id = rows[0][0]
+        return user_id, [character_uuid for _, character_uuid in rows]
 
     ################################### READ ###################################
 
@@ -96,11 +179,15 @@ class WorldDB:
             return max_characters
 
     async def get_character_by_uuid(self, character_uuid: str) -> Character:
+        character = self.characters.get(character_uuid)
+        if character is not LRUCache.MISSING:
+            return character
         async with self.session() as session:
             statement = select(Character).where(Character.uuid == character_uuid)
             result = await session.execute(statement)
             character = result.scalars().one()
-            return character
+        self.characters.put(character_uuid, character)
+        return character
 
     async def get_character_uuid_by_name(self, name: str) -> str:
         async with self.session() as session:
@@ -110,23 +197,19 @@ class WorldDB:
             return character_uuid
 
     async def get_character_location_by_uuid(self, character_uuid: str) -> Tuple[int, float, float]:
-        async with self.session() as session:
-            statement = select(Character).where(Character.uuid == character_uuid)
-            result = await session.execute(statement)
-            character = result.scalars().one()
-            return character.map_id, character.x, character.y
+        async with self.connection() as connection:
+            location = await connection.fetchrow(SELECT_LOCATION, character_uuid)
+        if location is None:
+            raise sqlalchemy.exc.NoResultFound("No Character with UUID {}".format(character_uuid))
+        return tuple(location)
 
     async def check_character_name_exists(self, name: str) -> bool:
-        async with self.session() as session:
-            statement = select(Character).where(Character.name == name)
-            result = await session.execute(statement)
-            character = result.scalars().one_or_none()
-            return character is not None
+        async with self.connection() as connection:
+            return await connection.fetchval(SELECT_NAME_EXISTS, name)
 
     async def check_user_has_max_characters(self, user_id: int) -> bool:
-        async with self.session() as session:
-            character_uuids, max_characters = await asyncio.gather(self.get_user_character_uuids(user_id), self.get_user_max_characters(user_id))
-            return len(character_uuids) == max_characters
+        async with self.connection() as connection:
+            return bool(await connection.fetchval(SELECT_HAS_MAX_CHARACTERS, user_id))
 
     ################################## UPDATE ##################################
 
@@ -138,13 +221,30 @@ class WorldDB:
             character.map_id = player.get("map_id")
             character.x, character.y = player.get("position")
             await session.merge(character)
+        self.characters.invalidate(character_uuid)
+
+    async def update_characters(self, characters: List[dict]):
+        # Writes the locations of many Characters in one transaction, as one executemany per chunk instead of a SELECT and merge each
+        updated_at = datetime.utcnow()  # Set explicitly so cached Characters can be given the same value
+        rows = [(row["character_uuid"], row["character_map_id"], row["character_x"], row["character_y"], updated_at) for row in characters]
+        async with self.connection() as connection:
+            async with connection.transaction():
+                for start in range(0, len(rows), DATABASE_SYNC_CHUNK_SIZE):
+                    await connection.executemany(UPDATE_LOCATION, rows[start:start + DATABASE_SYNC_CHUNK_SIZE])
+        for row in characters:
+            character = self.characters.peek(row["character_uuid"])
+            if character is not LRUCache.MISSING:
+                character.map_id, character.x, character.y = row["character_map_id"], row["character_x"], row["character_y"]
+                character.updated_at = updated_at
 
     async def delete_character_by_uuid(self, character_uuid: str):
         async with self.session() as session:
             statement = select(Character).where(Character.uuid == character_uuid)
             result = await session.execute(statement)
             character = result.scalars().one()
-            character.is_deleted = True
-            await session.merge(character)
+            if not character.is_deleted:
+                character.is_deleted = True
+                await session.execute(update(User).where(User.id == character.user_id).values(character_count=User.character_count - 1))
+        self.characters.invalidate(character_uuid)
 
     ################################## DELETE ##################################
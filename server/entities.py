@@ -0,0 +1,204 @@
+import numpy as np
+from collections import deque
+from typing import Tuple, Optional
+from common.lib import GameState, PlayerState
+from .collision import CollisionGrid
+
+# Big-endian record layout of a packed GameState entry (PACKED_KEY followed by PlayerState.PACKED_FORMAT)
+ENTRY_DTYPE = np.dtype([
+    ("entity_id", ">u2"),
+    ("map_id", ">u4"),
+    ("x", ">f4"),
+    ("y", ">f4"),
+    ("travel_speed", ">u2"),
+    ("input_sequence", ">u4"),
+    ("updated_at", ">f8")
+])
+REPLICATED_FIELDS = ("map_id", "x", "y", "travel_speed", "input_sequence")  # updated_at is bumped every tick and would mark every entity as changed
+
+if ENTRY_DTYPE.itemsize != GameState.PACKED_KEY.size + PlayerState.PACKED_FORMAT.size:
+    raise ImportError("ENTRY_DTYPE is out of sync with the packed GameState entry layout")
+
+
+class EntityStore:
+    def __init__(self, capacity: int, initial_size: int = 1024):
+        self.capacity = capacity  # Highest entity ID that fits the wire format
+        self.ids = {}  # Mapping of Character UUIDs to entity IDs, which double as slots in the arrays below
+        self.uuids = {}  # Mapping of entity IDs to Character UUIDs
+        self.free_ids = deque()  # Released entity IDs, only reused oldest first once fresh ones run out so they have long left every delta baseline
+        self.next_id = 1
+
+        size = min(initial_size, capacity + 1)
+        self.active = np.zeros(size, dtype=bool)
+        self.map_ids = np.zeros(size, dtype=np.uint32)  # 0 stands for no map
+        self.positions = np.zeros((size, 2), dtype=np.float64)
+        self.velocities = np.zeros((size, 2), dtype=np.float64)
+        self.speeds = np.zeros(size, dtype=np.uint16)
+        self.input_sequences = np.zeros(size, dtype=np.uint32)
+        self.updated_at = np.zeros(size, dtype=np.float64)
+        self.reported = np.zeros((size, 2), dtype=np.float64)  # Latest position reported in MovementMode.POSITION, awaiting validation
+        self.pending = np.zeros(size, dtype=bool)  # Whether reported holds a position that was not validated yet
+        self.validated_at = np.zeros(size, dtype=np.float64)  # When the latest reported position was validated
+        self.strikes = np.zeros(size, dtype=np.float64)  # Movement violations, forgiven over time
+        self.generations = np.zeros(size, dtype=np.uint32)  # Bumped on every change to the persisted fields, map_id and position
+        self.persisted = np.zeros(size, dtype=np.uint32)  # Generation of every entity as of its latest durable write to the database
+
+    def allocate(self, character_uuid: str, entity_id: Optional[int] = None) -> int:
+        # entity_id adopts an ID handed out by another EntityStore, e.g. the one of the server process in a shard
+        if entity_id is not None:
+            self.next_id = max(self.next_id, entity_id + 1)
+            if entity_id in self.free_ids:
+                self.free_ids.remove(entity_id)
+        elif self.next_id <= self.capacity:
+            entity_id = self.next_id
+            self.next_id += 1
+        elif self.free_ids:
+            entity_id = self.free_ids.popleft()
+        else:
+            raise OverflowError("No entity IDs left for Character {}".format(character_uuid))
+        if entity_id >= len(self.active):
+            self.grow(min(max(len(self.active) * 2, entity_id + 1), self.capacity + 1))
+        self.ids[character_uuid] = entity_id
+        self.uuids[entity_id] = character_uuid
+        self.active[entity_id] = True
+        return entity_id
+
+    def release(self, character_uuid: str) -> int:
+        entity_id = self.ids.pop(character_uuid)
+        del self.uuids[entity_id]
+        self.active[entity_id] = False
+        self.velocities[entity_id] = 0
+        self.pending[entity_id] = False
+        self.validated_at[entity_id] = 0
+        self.strikes[entity_id] = 0
+        self.free_ids.append(entity_id)
+        return entity_id
+
+    def grow(self, size: int):
+        for name in ("active", "map_ids", "positions", "velocities", "speeds", "input_sequences", "updated_at", "reported", "pending", "validated_at", "strikes", "generations", "persisted"):
+            array = getattr(self, name)
+            grown = np.zeros((size, *array.shape[1:]), dtype=array.dtype)
+            grown[:len(array)] = array
+            setattr(self, name, grown)
+
+    def spawn(self, character_uuid: str, **kwargs) -> "EntityState":
+        entity_id = self.allocate(character_uuid)
+        return EntityState(self, entity_id, **kwargs)
+
+    def slots(self) -> np.ndarray:
+        return np.flatnonzero(self.active[:self.next_id])
+
+    def touch(self, slots: np.ndarray, timestamp: float):
+        self.updated_at[slots] = timestamp
+
+    def simulate(self, slots: np.ndarray, dt: float, collision: Optional[CollisionGrid] = None) -> np.ndarray:
+        # Vectorized simulate_movement() over every moving entity in slots, returns the entity IDs that moved
+        moving = slots[np.any(self.velocities[slots] != 0, axis=1)]
+        positions = self.positions[moving] + self.velocities[moving] * self.speeds[moving, np.newaxis] * dt
+        if collision is not None:
+            positions = collision.clamp(self.positions[moving], positions)
+        self.move(moving, positions)
+        return moving
+
+    def move(self, entity_ids: np.ndarray, positions: np.ndarray):
+        # Only entities that actually ended up somewhere else become dirty, players walking into a wall stay clean
+        changed = np.any(self.positions[entity_ids] != positions, axis=1)
+        self.positions[entity_ids] = positions
+        self.generations[entity_ids[changed]] += 1
+
+    def dirty(self, entity_ids: np.ndarray) -> np.ndarray:
+        # Entities whose map or position changed since they were last persisted
+        entity_ids = np.asarray(entity_ids, dtype=np.int64)
+        return entity_ids[self.generations[entity_ids] != self.persisted[entity_ids]]
+
+    def persist(self, entity_ids: np.ndarray, generations: Optional[np.ndarray] = None):
+        # generations are the ones the written rows were copied at, changes made during the write keep the entities dirty
+        self.persisted[entity_ids] = self.generations[entity_ids] if generations is None else generations
+
+    def records(self, entity_ids: np.ndarray) -> np.ndarray:
+        records = np.empty(len(entity_ids), dtype=ENTRY_DTYPE)
+        records["entity_id"] = entity_ids
+        records["map_id"] = self.map_ids[entity_ids]
+        records["x"] = self.positions[entity_ids, 0]
+        records["y"] = self.positions[entity_ids, 1]
+        records["travel_speed"] = self.speeds[entity_ids]
+        records["input_sequence"] = self.input_sequences[entity_ids]
+        records["updated_at"] = self.updated_at[entity_ids]
+        return records
+
+    def store(self, records: np.ndarray):
+        # Inverse of records(), for slots whose state is simulated elsewhere
+        entity_ids = records["entity_id"].astype(np.int64)
+        changed = (self.map_ids[entity_ids] != records["map_id"]) | (self.positions[entity_ids, 0] != records["x"]) | (self.positions[entity_ids, 1] != records["y"])
+        self.generations[entity_ids[changed]] += 1
+        self.map_ids[entity_ids] = records["map_id"]
+        self.positions[entity_ids, 0] = records["x"]
+        self.positions[entity_ids, 1] = records["y"]
+        self.speeds[entity_ids] = records["travel_speed"]
+        self.input_sequences[entity_ids] = records["input_sequence"]
+        self.updated_at[entity_ids] = records["updated_at"]
+
+
+class EntityState(PlayerState):
+    # PlayerState whose simulated fields live in an EntityStore slot rather than on the object
+
+    def __init__(self, store: EntityStore, entity_id: int, **kwargs):
+        self.store = store
+        self.entity_id = entity_id
+        super().__init__(**kwargs)
+
+    @property
+    def map_id(self) -> int:
+        return int(self.store.map_ids[self.entity_id]) or None
+
+    @map_id.setter
+    def map_id(self, map_id: int):
+        self.store.map_ids[self.entity_id] = map_id or 0
+        self.store.generations[self.entity_id] += 1
+
+    @property
+    def generation(self) -> int:
+        return int(self.store.generations[self.entity_id])
+
+    @property
+    def position(self) -> Tuple[float, float]:
+        x, y = self.store.positions[self.entity_id]
+        return float(x), float(y)
+
+    @position.setter
+    def position(self, position: Tuple[float, float]):
+        self.store.positions[self.entity_id] = position
+        self.store.generations[self.entity_id] += 1
+
+    @property
+    def velocity(self) -> Tuple[float, float]:
+        x, y = self.store.velocities[self.entity_id]
+        return float(x), float(y)
+
+    @velocity.setter
+    def velocity(self, velocity: Tuple[float, float]):
+        self.store.velocities[self.entity_id] = velocity
+
+    @property
+    def travel_speed(self) -> int:
+        return int(self.store.speeds[self.entity_id])
+
+    @travel_speed.setter
+    def travel_speed(self, travel_speed: int):
+        self.store.speeds[self.entity_id] = travel_speed
+
+    @property
+    def input_sequence(self) -> int:
+        return int(self.store.input_sequences[self.entity_id])
+
+    @input_sequence.setter
+    def input_sequence(self, input_sequence: int):
+        self.store.input_sequences[self.entity_id] = input_sequence
+
+    @property
+    def updated_at(self) -> float:
+        return float(self.store.updated_at[self.entity_id])
+
+    @updated_at.setter
+    def updated_at(self, updated_at: float):
+        self.store.updated_at[self.entity_id] = updated_at
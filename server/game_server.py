@@ -1,8 +1,15 @@
-import asyncio, websockets, aiohttp, random, string, sqlalchemy.exc, traceback
+import asyncio, websockets, aiohttp, random, string, traceback, time, struct
+from collections import deque
 from http import HTTPStatus
-from typing import Optional, Tuple
-from common.lib import NetworkPacket, GameState, PlayerState, SessionEvent, MovementEvent, ErrorEvent, ErrorCode, ErrorSeverity, ErrorNature, generate_pseudo_uuid, calculate_distance, calculate_velocity
+from typing import Optional, Tuple, List
+from common.lib import NetworkPacket, GameState, GameStateCodec, MetaInfo, MovementMode, SessionEvent, MovementEvent, EntityEvent, SnapshotAck, ErrorEvent, ErrorCode, ErrorSeverity, ErrorNature, generate_pseudo_uuid
 from .crud import WorldDB
+from .outbound import OutboundQueue
+from .inbound import MovementBuffer
+from .recorder import PacketRecorder
+from .entities import EntityStore
+from .world import World
+from .shards import ShardRouter
 from .config import *
 
 
@@ -11,9 +18,11 @@ class GameServer:
         self.host = kwargs.get("host", "127.0.0.1")
         self.port = kwargs.get("port", 8787)
         self.auth_mode = kwargs.get("auth_mode", True)
+        self.clock = kwargs.get("clock", time.monotonic)  # Same clock as the default asyncio event loop's, replaced with a fake one for replays
 
         self.db = WorldDB()
         self.gs = GameState()
+        self.entities = EntityStore(MAX_ENTITY_ID)  # Struct-of-arrays storage of every spawned player, indexed by the entity IDs standing in for Character UUIDs in game states
         self.clients = set()
         self.users = {}  # Mapping of self.clients to dictionaries of their user data
         self.tasks = {}  # Mapping of self.clients to dictionaries of their tasks
@@ -21,36 +30,89 @@ class GameServer:
         self.tokens = {}  # Mapping of access tokens to User UUIDs from the Authentication Server
         self.players = {}  # Mapping of self.clients to PlayerState objects in the GameState
         self.characters = {}  # Mapping of self.clients to Character UUIDs they are logged in as
+        self.entity_clients = {}  # Mapping of entity IDs to the self.clients logged in as them
+        self.moving_clients = set()  # self.clients with buffered movement the simulation has yet to apply
+        self.movement_mode = MovementMode[MOVEMENT_MODE]
+        # Simulates the maps and encodes their game states, either in this process or in shard worker processes
+        self.simulation = World(self.entities, self.movement_mode, self.clock) if SHARD_WORKERS == 0 else ShardRouter(SHARD_WORKERS, self.entities, self.movement_mode)
+        self.tick = 0  # Number of simulation loop iterations, recorded with inbound packets
+        self.recorder = PacketRecorder(RECORD_PATH, self.clock) if RECORD_PATH is not None else None
 
-        self.delta_time = 1 / SERVER_TICK_HZ  # Time since last simulation loop
+        self.broadcast_durations = deque(maxlen=BROADCAST_STATS_SIZE)  # Time spent fanning out game states in the latest ticks
 
     async def run(self):
-        async with websockets.serve(self.handle_connection, self.host, self.port, process_request=self.process_request):
-            print(f"[{self.__class__.__name__}] Recreating the database...")
-            await self.db.recreate_database()
-            await self.db.populate_database()
-            print(f"[{self.__class__.__name__}] Started the server!")
-            await asyncio.Future()
+        try:
+            async with websockets.serve(self.handle_connection, self.host, self.port, process_request=self.process_request):
+                print(f"[{self.__class__.__name__}] Recreating the database...")
+                await self.db.recreate_database()
+                await self.db.populate_database()
+                print(f"[{self.__class__.__name__}] Started the server!")
+                await asyncio.Future()
+        finally:
+            if isinstance(self.simulation, ShardRouter):
+                self.simulation.close()
+            if self.recorder is not None:
+                self.recorder.close()
 
     async def simulation_loop(self):
         while True:
-            start_time = asyncio.get_running_loop().time()
+            now = self.clock()
+            if self.recorder is not None:
+                self.recorder.schedule(self.tick, now)
+            await asyncio.sleep(self.simulation.delay(now))
+            now = self.clock()
+            if self.recorder is not None:
+                self.recorder.tick(self.tick, now)
+            self.run_tick(now)
+
+    def run_tick(self, now: float):
+        self.tick += 1
+        self.apply_movement()
+        self.broadcast_game_states(self.simulation.tick(now))
 
-            for player in self.gs.player_states.values():
-                player.updated_at = start_time
+    def apply_movement(self):
+        for client in self.moving_clients:
+            movement_queue = self.queues[client]["movement_queue"]
+            payload = movement_queue.take()
+            if payload is None or client not in self.players:
+                continue
+            # Decoded in the shared tick, so a bad payload must only cost its own client the input
+            try:
+                event = MovementEvent.unpack(payload)
+            except struct.error:
+                movement_queue.malformed += 1
+                continue
+            self.simulation.move(self.players[client].entity_id, event)
+        self.moving_clients.clear()
 
-            elapsed_time = asyncio.get_running_loop().time() - start_time
-            await asyncio.sleep(max(0, 1 / SERVER_TICK_HZ - elapsed_time))
-            self.delta_time = max(1 / SERVER_TICK_HZ, elapsed_time)
+    def tick_stats(self) -> dict:
+        return self.simulation.tick_stats()
+
+    def database_stats(self) -> dict:
+        return {"pool": self.db.pool_stats(), "cache": self.db.cache_stats()}
 
     async def database_sync_task(self):
         while True:
-            for character_uuid, player in self.gs.player_states.items():
-                await self.database_sync_player(character_uuid, player)
+            await self.database_sync_players(list(self.gs.player_states))
             await asyncio.sleep(1 / DATABASE_SYNC_HZ)
 
-    async def database_sync_player(self, character_uuid: str, player: PlayerState):
-        await self.db.update_chracter_by_uuid(character_uuid, player.to_dict())
+    async def database_sync_players(self, entity_ids: List[int]):
+        # Only Characters that moved since their last write are persisted, idle players cost nothing
+        entity_ids = self.entities.dirty(entity_ids)
+        if len(entity_ids) == 0:
+            return
+        # Rows are copied out before the first await, so a flush writes the locations of a single tick
+        generations = self.entities.generations[entity_ids]
+        await self.db.update_characters(self.character_rows(entity_ids.tolist()))
+        self.entities.persist(entity_ids, generations)
+
+    def character_rows(self, entity_ids: List[int]) -> List[dict]:
+        map_ids = self.entities.map_ids[entity_ids].tolist()
+        positions = self.entities.positions[entity_ids].tolist()
+        return [
+            {"character_uuid": self.entities.uuids[entity_id], "character_map_id": map_id or None, "character_x": x, "character_y": y}
+            for entity_id, map_id, (x, y) in zip(entity_ids, map_ids, positions)
+        ]
 
     async def process_request(self, path: str, request_headers: websockets.Headers) -> Optional[Tuple[HTTPStatus, websockets.datastructures.HeadersLike, bytes]]:
         try:
@@ -85,10 +147,7 @@ class GameServer:
     async def handle_connection(self, client: websockets.WebSocketServerProtocol, path: str):
         try:
             print(f"[{self.__class__.__name__}] Adding client: {client}")
-            self.clients.add(client)
-            self.users[client] = {}
-            self.tasks[client] = {}
-            self.queues[client] = {}
+            self.open_client(client)
             await self.handle_client(client)
         except websockets.exceptions.ConnectionClosedError:
             pass
@@ -97,21 +156,39 @@ class GameServer:
             traceback.print_exc()
         finally:
             print(f"[{self.__class__.__name__}] Removing client: {client}")
-            await self.handle_disconnection(client)
-            self.clients.remove(client)
-            for task in self.tasks[client].values(): task.cancel()
-            del self.users[client]
-            del self.tasks[client]
-            del self.queues[client]
+            await self.close_client(client)
+
+    def open_client(self, client: websockets.WebSocketServerProtocol):
+        self.clients.add(client)
+        self.users[client] = {}
+        self.tasks[client] = {}
+        self.queues[client] = {
+            "inbound_queue": asyncio.Queue(),
+            "outbound_queue": OutboundQueue(OUTBOUND_QUEUE_SIZE),
+            "movement_queue": MovementBuffer(MOVEMENT_PACKET_RATE, MOVEMENT_PACKET_BURST)
+        }
+        if self.recorder is not None:
+            self.recorder.connect(client, self.tick)
+
+    async def close_client(self, client: websockets.WebSocketServerProtocol):
+        if self.recorder is not None:
+            self.recorder.disconnect(client, self.tick)
+        await self.handle_disconnection(client)
+        self.clients.remove(client)
+        for task in self.tasks[client].values(): task.cancel()
+        del self.users[client]
+        del self.tasks[client]
+        del self.queues[client]
+        self.moving_clients.discard(client)
 
     async def handle_disconnection(self, client: websockets.WebSocketServerProtocol):
         if client in self.players: await self.despawn_player(client)
 
     async def handle_client(self, client: websockets.WebSocketServerProtocol):
         await self.init_user(client)
-        self.queues[client]["inbound_queue"] = asyncio.Queue()
-        self.queues[client]["outbound_queue"] = asyncio.Queue()
-        self.queues[client]["movement_queue"] = asyncio.Queue()
+        if self.recorder is not None:
+            user = self.users[client]
+            self.recorder.user(client, self.tick, {"id": user["id"], "uuid": user["uuid"], "characters": list(user["characters"])})
         self.tasks[client]["pull_task"] = asyncio.create_task(self.pull_task(client))
         self.tasks[client]["push_task"] = asyncio.create_task(self.push_task(client))
         self.tasks[client]["handler_task"] = asyncio.create_task(self.handle_packet(client))
@@ -120,51 +197,72 @@ class GameServer:
     async def init_user(self, client: websockets.WebSocketServerProtocol):
         access_token = client.request_headers["Authorization"].split()[1]
         user_uuid = self.tokens[access_token]
-        try:
-            user_id = await self.db.get_user_id_by_uuid(user_uuid)
-        except sqlalchemy.exc.NoResultFound:
-            await self.db.create_user(user_uuid)
-            user_id = await self.db.get_user_id_by_uuid(user_uuid)
-        finally:
-            await self.db.create_character(user_id, {"name": "".join(random.choices(string.ascii_letters, k=8))}, {})
-            character_uuids = await self.db.get_user_character_uuids(user_id)
-            self.users[client]["id"] = user_id
-            self.users[client]["uuid"] = user_uuid
-            self.users[client]["characters"] = {uuid for uuid in character_uuids}
+        user_id, character_uuids = await self.db.bootstrap_user(user_uuid, "".join(random.choices(string.ascii_letters, k=8)))
+        self.users[client]["id"] = user_id
+        self.users[client]["uuid"] = user_uuid
+        self.users[client]["characters"] = {uuid for uuid in character_uuids}
+        self.users[client]["codec"] = GameStateCodec.JSON
 
-    async def send(self, client: websockets.WebSocketServerProtocol, packet: NetworkPacket):
-        await client.send(packet.pack())
+    async def send(self, client: websockets.WebSocketServerProtocol, packets: List[NetworkPacket]):
+        await client.send(NetworkPacket.pack_batch(packets))
 
-    async def recv(self, client: websockets.WebSocketServerProtocol) -> NetworkPacket:
+    async def recv(self, client: websockets.WebSocketServerProtocol) -> List[NetworkPacket]:
         data = await client.recv()
-        packet = NetworkPacket.unpack(data)
-        return packet
+        packets = NetworkPacket.unpack_batch(data)
+        return packets
 
     async def pull_task(self, client: websockets.WebSocketServerProtocol):
         """ PULL TASK """
         while True:
-            packet = await self.recv(client)
-            # print(f"[{self.__class__.__name__}] Received ({packet.type}) message: {packet.payload}")
-            await self.queues[client]["inbound_queue"].put(packet)
+            for packet in await self.recv(client):
+                # print(f"[{self.__class__.__name__}] Received ({packet.type}) message: {packet.payload}")
+                await self.queues[client]["inbound_queue"].put(packet)
 
     async def push_task(self, client: websockets.WebSocketServerProtocol):
         """ PUSH TASK """
+        outbound_queue = self.queues[client]["outbound_queue"]
         while True:
-            packet = await self.queues[client]["outbound_queue"].get()
-            await self.send(client, packet)
-            # print(f"[{self.__class__.__name__}] Sent ({packet.type}) message: {packet.payload}")
+            packets = [await outbound_queue.get()]
+            while not outbound_queue.empty():
+                packets.append(outbound_queue.get_nowait())
+            await self.send(client, packets)
+            # print(f"[{self.__class__.__name__}] Sent {len(packets)} messages: {[packet.type for packet in packets]}")
 
     async def handle_packet(self, client: websockets.WebSocketServerProtocol):
-        outbound_queue = self.queues[client]["outbound_queue"]
         while True:
             packet = await self.queues[client]["inbound_queue"].get()
-            match packet.type:
-                case NetworkPacket.PacketType.SESSION:
-                    event = SessionEvent.deserialize(packet.payload)
-                    await self.handle_session_event(client, event)
-                case NetworkPacket.PacketType.MOVEMENT:
-                    event = MovementEvent.deserialize(packet.payload)
-                    await self.handle_movement_event(client, event)
+            if self.recorder is not None:
+                self.recorder.packet(client, self.tick, packet)
+            await self.dispatch_packet(client, packet)
+
+    async def dispatch_packet(self, client: websockets.WebSocketServerProtocol, packet: NetworkPacket):
+        match packet.type:
+            case NetworkPacket.PacketType.META:
+                meta = MetaInfo.deserialize(packet.payload)
+                await self.handle_meta_event(client, meta)
+            case NetworkPacket.PacketType.SESSION:
+                event = SessionEvent.deserialize(packet.payload)
+                await self.handle_session_event(client, event)
+            case NetworkPacket.PacketType.MOVEMENT:
+                # Decoded and applied once per tick by apply_movement()
+                movement_queue = self.queues[client]["movement_queue"]
+                if len(packet.payload) not in MovementEvent.PACKED_SIZES:
+                    movement_queue.reject()
+                elif movement_queue.put(packet.payload, self.clock()):
+                    self.moving_clients.add(client)
+            case NetworkPacket.PacketType.ACK:
+                ack = SnapshotAck.deserialize(packet.payload)
+                await self.handle_ack_event(client, ack)
+
+    async def handle_meta_event(self, client: websockets.WebSocketServerProtocol, meta: MetaInfo):
+        codecs = meta.kwargs.get("codecs")
+        if codecs is not None:
+            supported_codecs = [GameStateCodec[name].value for name in GAMESTATE_CODECS]
+            codec = next((GameStateCodec(value) for value in codecs if value in supported_codecs), GameStateCodec.JSON)
+            self.users[client]["codec"] = codec
+            meta = MetaInfo(codec=codec.value, movement_mode=self.movement_mode.value)
+            packet = NetworkPacket(NetworkPacket.PacketType.META, meta.serialize())
+            await self.queues[client]["outbound_queue"].put(packet)
 
     async def handle_session_event(self, client: websockets.WebSocketServerProtocol, event: SessionEvent):
         match event.command:
@@ -185,18 +283,19 @@ class GameServer:
                     error = ErrorEvent(ErrorCode.CONFLICT, ErrorSeverity.LOW, ErrorNature.BENIGN, "Currently logged in", "{}".format(event))
                 else:
                     character = await self.db.get_character_by_uuid(character_uuid)
-                    event = SessionEvent(SessionEvent.SessionCommand.LOGIN, character=character.to_dict())
+                    await self.spawn_player(client, character_uuid)
+                    event = SessionEvent(SessionEvent.SessionCommand.LOGIN, character=character.to_dict(), entity_id=self.entities.ids[character_uuid])
                     packet = NetworkPacket(NetworkPacket.PacketType.SESSION, event.serialize())
                     await self.queues[client]["outbound_queue"].put(packet)
-                    await self.spawn_player(client, character_uuid)
-                    self.tasks[client]["publish_game_state"] = asyncio.create_task(self.publish_game_state(client))
+                    event = EntityEvent(EntityEvent.EntityCommand.SPAWN, dict(self.entities.uuids))
+                    packet = NetworkPacket(NetworkPacket.PacketType.ENTITY, event.serialize())
+                    await self.queues[client]["outbound_queue"].put(packet)
+                    self.simulation.spawn(self.players[client].entity_id, self.users[client]["codec"])
             case SessionEvent.SessionCommand.LOGOUT:
                 if client not in self.players:
                     error = ErrorEvent(ErrorCode.CONFLICT, ErrorSeverity.LOW, ErrorNature.BENIGN, "Currently logged out", "{}".format(event))
                 else:
                     await self.despawn_player(client)
-                    self.tasks[client]["publish_game_state"].cancel()
-                    del self.tasks[client]["publish_game_state"]
                     event = SessionEvent(SessionEvent.SessionCommand.LOGOUT)
                     packet = NetworkPacket(NetworkPacket.PacketType.SESSION, event.serialize())
                     await self.queues[client]["outbound_queue"].put(packet)
@@ -217,6 +316,8 @@ class GameServer:
                     print("CREATING CHARACTER")
                     await self.db.create_character(self.users[client]["id"], character_attributes, character_properties)
                     character_uuid = await self.db.get_character_uuid_by_name(character_attributes["name"])
+                    if self.recorder is not None:
+                        self.recorder.character(client, self.tick, {"uuid": character_uuid, "name": character_attributes["name"]})
                     self.users[client]["characters"].add(character_uuid)
                     event = SessionEvent(SessionEvent.SessionCommand.CREATE, character_uuid=character_uuid)
                     packet = NetworkPacket(NetworkPacket.PacketType.SESSION, event.serialize())
@@ -237,37 +338,58 @@ class GameServer:
                     packet = NetworkPacket(NetworkPacket.PacketType.SESSION, event.serialize())
                     await self.queues[client]["outbound_queue"].put(packet)
 
-    async def handle_movement_event(self, client: websockets.WebSocketServerProtocol, event: MovementEvent):
-        self.players[client].velocity = calculate_velocity(event.keys)
-        old_pos = self.players[client].position
-        new_pos = event.position
-        distance = calculate_distance(old_pos, new_pos)
-        print(old_pos, new_pos, distance)
-        self.players[client].position = new_pos
+    async def handle_ack_event(self, client: websockets.WebSocketServerProtocol, ack: SnapshotAck):
+        if client in self.players:
+            self.simulation.ack(self.players[client].entity_id, ack.snapshot_id)
 
-    async def publish_game_state(self, client: websockets.WebSocketServerProtocol):
-        while True:
-            game_state = self.filter_game_state(client)
-            packet = NetworkPacket(NetworkPacket.PacketType.GAMESTATE, game_state.serialize())
-            await self.queues[client]["outbound_queue"].put(packet)
-            await asyncio.sleep(1 / SERVER_TICK_HZ)
+    def broadcast_game_states(self, packets: List[Tuple[int, NetworkPacket]]):
+        start_time = asyncio.get_running_loop().time()
+        for entity_id, packet in packets:
+            client = self.entity_clients.get(entity_id)
+            if client is None:
+                continue
+            outbound_queue = self.queues[client]["outbound_queue"]
+            outbound_queue.put_nowait(packet)
+            if outbound_queue.is_overdue(OUTBOUND_BACKLOG_TIMEOUT) and "kick_task" not in self.tasks[client]:
+                print(f"[{self.__class__.__name__}] Kicking slow client: {client}", outbound_queue.stats())
+                self.tasks[client]["kick_task"] = asyncio.create_task(client.close(1008, "Outbound backlog exceeded"))
+        self.broadcast_durations.append(asyncio.get_running_loop().time() - start_time)
 
-    def filter_game_state(self, client: websockets.WebSocketServerProtocol) -> GameState:
-        player_states = {character_uuid: player for character_uuid, player in self.gs.player_states.items() if player.map_id == self.players[client].map_id}
-        return GameState(player_states=player_states, delta_time=self.delta_time)
+    def client_stats(self, client: websockets.WebSocketServerProtocol) -> dict:
+        return {
+            "outbound_queue": self.queues[client]["outbound_queue"].stats(),
+            "movement_queue": self.queues[client]["movement_queue"].stats()
+        }
 
     async def spawn_player(self, client: websockets.WebSocketServerProtocol, character_uuid: str):
         character = await self.db.get_character_by_uuid(character_uuid)
-        player_state = PlayerState(map_id=character.map_id, x=character.x, y=character.y, travel_speed=200)
-        self.gs.player_states[character_uuid] = player_state
+        if self.recorder is not None:
+            self.recorder.character(client, self.tick, character.to_dict())
+        player_state = self.entities.spawn(character_uuid, map_id=character.map_id, travel_speed=200)
+        entity_id = player_state.entity_id
+        self.gs.player_states[entity_id] = player_state
         self.players[client] = player_state
         self.characters[client] = character_uuid
+        self.entity_clients[entity_id] = client
 
         self.players[client].position = (character.x, character.y)
+        self.entities.persist([entity_id])  # Just loaded, so it matches the database
+        self.publish_entity_event(EntityEvent(EntityEvent.EntityCommand.SPAWN, {entity_id: character_uuid}), exclude=client)
 
     async def despawn_player(self, client: websockets.WebSocketServerProtocol):
         character_uuid = self.characters[client]
-        await self.database_sync_player(character_uuid, self.gs.player_states[character_uuid])
-        del self.gs.player_states[character_uuid]
+        entity_id = self.entities.ids[character_uuid]
+        await self.database_sync_players([entity_id])
+        del self.gs.player_states[entity_id]
+        self.simulation.despawn(entity_id)
         del self.players[client]
         del self.characters[client]
+        del self.entity_clients[entity_id]
+        self.entities.release(character_uuid)
+        self.publish_entity_event(EntityEvent(EntityEvent.EntityCommand.DESPAWN, {entity_id: character_uuid}), exclude=client)
+
+    def publish_entity_event(self, event: EntityEvent, exclude: websockets.WebSocketServerProtocol = None):
+        packet = NetworkPacket(NetworkPacket.PacketType.ENTITY, event.serialize())
+        for client in self.players:
+            if client is not exclude:
+                self.queues[client]["outbound_queue"].put_nowait(packet)
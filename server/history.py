@@ -0,0 +1,57 @@
+import numpy as np
+from typing import Union
+
+
+class PositionHistory:
+    # Positions of every entity at its last length ticks, in flat ring buffers indexed by entity ID like EntityStore
+
+    def __init__(self, length: int, initial_size: int = 1024):
+        self.length = length
+        self.heads = np.full(initial_size, -1, dtype=np.int64)  # Index of the newest sample of every entity, -1 for none
+        self.positions = np.zeros((initial_size, length, 2), dtype=np.float32)
+        self.times = np.full((initial_size, length), -np.inf)  # Server time of every sample, -inf for unused ones
+
+    def grow(self, size: int):
+        for name, fill in (("heads", -1), ("positions", 0), ("times", -np.inf)):
+            array = getattr(self, name)
+            grown = np.full((size, *array.shape[1:]), fill, dtype=array.dtype)
+            grown[:len(array)] = array
+            setattr(self, name, grown)
+
+    def reset(self, entity_id: int):
+        if entity_id < len(self.heads):
+            self.heads[entity_id] = -1
+            self.times[entity_id] = -np.inf
+
+    def ensure(self, entity_ids: np.ndarray):
+        if len(entity_ids) and entity_ids.max() >= len(self.heads):
+            self.grow(max(len(self.heads) * 2, int(entity_ids.max()) + 1))
+
+    def record(self, entity_ids: np.ndarray, positions: np.ndarray, timestamp: float):
+        self.ensure(entity_ids)
+        heads = (self.heads[entity_ids] + 1) % self.length
+        self.heads[entity_ids] = heads
+        self.positions[entity_ids, heads] = positions
+        self.times[entity_ids, heads] = timestamp
+
+    def positions_at(self, entity_ids: np.ndarray, timestamps: Union[float, np.ndarray]) -> np.ndarray:
+        # Interpolates where every entity was at the matching server time, clamped to the oldest and newest sample
+        # Entities without samples come back as NaN
+        entity_ids = np.asarray(entity_ids, dtype=np.int64)
+        self.ensure(entity_ids)
+        timestamps = np.broadcast_to(np.asarray(timestamps, dtype=np.float64), entity_ids.shape)
+        index = np.arange(len(entity_ids))
+        order = (self.heads[entity_ids, np.newaxis] + 1 + np.arange(self.length)) % self.length  # Oldest to newest
+        times = self.times[entity_ids[:, np.newaxis], order]
+        positions = self.positions[entity_ids[:, np.newaxis], order].astype(np.float64)
+
+        after = np.minimum((times <= timestamps[:, np.newaxis]).sum(axis=1), self.length - 1)
+        before = np.maximum(after - 1, 0)
+        before_times, after_times = times[index, before], times[index, after]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            span = after_times - before_times
+            weight = np.where(np.isfinite(span) & (span > 0), (timestamps - before_times) / span, 1.0)
+        weight = np.clip(weight, 0, 1)[:, np.newaxis]
+        result = positions[index, before] * (1 - weight) + positions[index, after] * weight
+        result[self.heads[entity_ids] < 0] = np.nan
+        return result
@@ -0,0 +1,50 @@
+from typing import Optional, Union
+
+
+class MovementBuffer:
+    # Keeps only the newest MOVEMENT payload of a client until the simulation applies it, rate limiting what comes in
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate  # Sustained MOVEMENT packets per second accepted from the client
+        self.burst = burst  # MOVEMENT packets accepted back to back before the rate applies
+        self.tokens = burst
+        self.refilled_at = None
+        self.latest = None  # Newest payload not applied yet
+        self.received = 0
+        self.coalesced = 0  # Payloads replaced by a newer one before they were applied
+        self.dropped = 0  # Payloads discarded undecoded for arriving faster than the rate limit
+        self.malformed = 0  # Payloads discarded for not being a valid MovementEvent
+        self.applied = 0
+
+    def put(self, payload: Union[bytes, memoryview], now: float) -> bool:
+        self.received += 1
+        if self.refilled_at is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+        if self.tokens < 1:
+            self.dropped += 1
+            return False
+        self.tokens -= 1
+        if self.latest is not None:
+            self.coalesced += 1
+        self.latest = payload
+        return True
+
+    def reject(self):
+        self.received += 1
+        self.malformed += 1
+
+    def take(self) -> Optional[Union[bytes, memoryview]]:
+        payload, self.latest = self.latest, None
+        if payload is not None:
+            self.applied += 1
+        return payload
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "malformed": self.malformed,
+            "applied": self.applied
+        }
@@ -0,0 +1,84 @@
+import numpy as np
+from typing import Tuple, Set, Iterator, Optional
+
+
+class InterestGrid:
+    def __init__(self, cell_size: float):
+        self.cell_size = cell_size
+        self.cells = {}  # Mapping of (column, row) cells to sets of entity IDs inside them
+        self.entities = {}  # Mapping of entity IDs to the cell they are in
+
+    def cell(self, position: Tuple[float, float]) -> Tuple[int, int]:
+        return int(position[0] // self.cell_size), int(position[1] // self.cell_size)
+
+    def update(self, entity_id: int, position: Tuple[float, float]):
+        cell = self.cell(position)
+        old_cell = self.entities.get(entity_id)
+        if cell == old_cell:
+            return
+        if old_cell is not None:
+            self.discard(entity_id, old_cell)
+        self.cells.setdefault(cell, set()).add(entity_id)
+        self.entities[entity_id] = cell
+
+    def remove(self, entity_id: int):
+        cell = self.entities.pop(entity_id, None)
+        if cell is not None:
+            self.discard(entity_id, cell)
+
+    def discard(self, entity_id: int, cell: Tuple[int, int]):
+        members = self.cells[cell]
+        members.discard(entity_id)
+        if not members:
+            del self.cells[cell]
+
+    def query(self, position: Tuple[float, float], radius: float) -> Iterator[int]:
+        min_column, min_row = self.cell((position[0] - radius, position[1] - radius))
+        max_column, max_row = self.cell((position[0] + radius, position[1] + radius))
+        for column in range(min_column, max_column + 1):
+            for row in range(min_row, max_row + 1):
+                members = self.cells.get((column, row))
+                if members:
+                    yield from members
+
+
+class InterestManager:
+    def __init__(self, cell_size: float, view_radius: float, hysteresis: float):
+        self.cell_size = cell_size
+        self.view_radius = view_radius  # Distance at which players come into view
+        self.hysteresis = hysteresis  # Extra distance players must move past the view radius before they drop out of view
+        self.grids = {}  # Mapping of Map IDs to InterestGrids
+        self.locations = {}  # Mapping of entity IDs to the Map ID they are on
+        self.visible = {}  # Mapping of observing entity IDs to the set of entity IDs they saw last query
+
+    def update(self, entity_id: int, map_id: int, position: Tuple[float, float]):
+        old_map_id = self.locations.get(entity_id)
+        if old_map_id is not None and old_map_id != map_id:
+            self.remove(entity_id)
+        if map_id not in self.grids:
+            self.grids[map_id] = InterestGrid(self.cell_size)
+        self.grids[map_id].update(entity_id, position)
+        self.locations[entity_id] = map_id
+
+    def remove(self, entity_id: int):
+        map_id = self.locations.pop(entity_id, None)
+        if map_id is not None:
+            grid = self.grids[map_id]
+            grid.remove(entity_id)
+            if not grid.entities:
+                del self.grids[map_id]
+        self.visible.pop(entity_id, None)
+
+    def query(self, entity_id: int, positions: np.ndarray) -> Optional[Set[int]]:
+        # positions is indexed by entity ID, e.g. EntityStore.positions
+        map_id = self.locations.get(entity_id)
+        if map_id is None:
+            return None
+        position = positions[entity_id]
+        candidates = np.fromiter(self.grids[map_id].query(position, self.view_radius + self.hysteresis), dtype=np.int64)
+        distances = ((positions[candidates] - position) ** 2).sum(axis=1)
+        previously_visible = np.fromiter(self.visible.get(entity_id, ()), dtype=np.int64)
+        in_view = (distances <= self.view_radius ** 2) | ((distances <= (self.view_radius + self.hysteresis) ** 2) & np.isin(candidates, previously_visible))
+        visible = set(candidates[in_view].tolist())
+        self.visible[entity_id] = visible
+        return visible
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Float, String, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, Float, String, DateTime, ForeignKey, Boolean, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -12,6 +12,7 @@ class User(Base):
     id = Column(Integer, primary_key=True)
     uuid = Column(String(32), unique=True, nullable=False)
     max_characters = Column(Integer, default=1)
+    character_count = Column(Integer, nullable=False, default=0, server_default="0")  # Characters that are not deleted, kept up to date by WorldDB
     characters = relationship(
         "Character",
         backref="user",
@@ -37,6 +38,12 @@ class Character(Base):
     x = Column(Float, default=0.0)
     y = Column(Float, default=0.0)
 
+    __table_args__ = (
+        Index("ix_characters_user_id", "user_id"),
+        # Backs User.characters and the lookups of a user's live Characters by name
+        Index("ix_characters_live_user_id_name", "user_id", "name", postgresql_where=is_deleted == False),
+    )
+
     def __repr__(self):
         return self.name
 
@@ -0,0 +1,70 @@
+import asyncio
+from collections import deque
+from common.lib import NetworkPacket
+
+
+class OutboundQueue:
+
+    COALESCED_TYPES = (NetworkPacket.PacketType.GAMESTATE,)  # Packet types where only the newest unsent packet matters
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize  # Backlog budget, reliable packets are still queued past it but start the backlog timer
+        self.packets = deque()
+        self.pending = {}  # Mapping of coalesced packet types to their unsent packet in self.packets
+        self.not_empty = asyncio.Event()
+        self.over_budget_since = None  # Loop time at which the backlog went over budget
+        self.peak_depth = 0
+        self.dropped = 0  # Coalesced packets replaced by a newer one before they could be sent
+        self.sent = 0
+
+    def qsize(self) -> int:
+        return len(self.packets)
+
+    def empty(self) -> bool:
+        return not self.packets
+
+    async def put(self, packet: NetworkPacket):
+        self.put_nowait(packet)
+
+    def put_nowait(self, packet: NetworkPacket):
+        if packet.type in self.COALESCED_TYPES:
+            stale_packet = self.pending.get(packet.type)
+            if stale_packet is not None:
+                self.packets.remove(stale_packet)
+                self.dropped += 1
+            self.pending[packet.type] = packet
+        self.packets.append(packet)
+        self.peak_depth = max(self.peak_depth, len(self.packets))
+        self.update_budget()
+        self.not_empty.set()
+
+    async def get(self) -> NetworkPacket:
+        while not self.packets:
+            self.not_empty.clear()
+            await self.not_empty.wait()
+        return self.get_nowait()
+
+    def get_nowait(self) -> NetworkPacket:
+        packet = self.packets.popleft()
+        if self.pending.get(packet.type) is packet:
+            del self.pending[packet.type]
+        self.sent += 1
+        self.update_budget()
+        return packet
+
+    def update_budget(self):
+        if len(self.packets) <= self.maxsize:
+            self.over_budget_since = None
+        elif self.over_budget_since is None:
+            self.over_budget_since = asyncio.get_running_loop().time()
+
+    def is_overdue(self, timeout: float) -> bool:
+        return self.over_budget_since is not None and asyncio.get_running_loop().time() - self.over_budget_since > timeout
+
+    def stats(self) -> dict:
+        return {
+            "depth": len(self.packets),
+            "peak_depth": self.peak_depth,
+            "dropped": self.dropped,
+            "sent": self.sent
+        }
@@ -0,0 +1,71 @@
+import struct, json
+from enum import Enum
+from typing import Callable, Iterator, Tuple
+from common.lib import NetworkPacket
+
+
+class RecordKind(Enum):
+    CONNECT = 0
+    DISCONNECT = 1
+    USER = 2  # JSON of the user data init_user() loaded from the database
+    CHARACTER = 3  # JSON of a Character the server loaded from or created in the database
+    PACKET = 4  # Packed inbound NetworkPacket, recorded right before it is dispatched
+    SCHEDULE = 5  # The simulation loop looked up when the next tick is due
+    TICK = 6  # The simulation loop ran a tick
+
+
+class PacketRecorder:
+    # Append-only binary log of everything needed to replay a GameServer session without network or database
+
+    FILE_HEADER = struct.Struct("!4sH")  # magic, version
+    RECORD_HEADER = struct.Struct("!BIIdI")  # RecordKind, client ID, tick, clock time, payload size
+    MAGIC = b"EDOR"
+    VERSION = 1
+
+    def __init__(self, path: str, clock: Callable[[], float]):
+        self.file = open(path, "wb")
+        self.file.write(self.FILE_HEADER.pack(self.MAGIC, self.VERSION))
+        self.clock = clock  # Times are recorded as is rather than relative to a start time, so replays compare them exactly like the live server did
+        self.client_ids = {}  # Mapping of clients to the IDs they are recorded under
+        self.next_client_id = 1
+
+    def record(self, kind: RecordKind, client_id: int, tick: int, payload: bytes = b"", timestamp: float = None):
+        timestamp = self.clock() if timestamp is None else timestamp
+        self.file.write(self.RECORD_HEADER.pack(kind.value, client_id, tick, timestamp, len(payload)))
+        self.file.write(payload)
+
+    def connect(self, client, tick: int):
+        self.client_ids[client] = self.next_client_id
+        self.next_client_id += 1
+        self.record(RecordKind.CONNECT, self.client_ids[client], tick)
+
+    def disconnect(self, client, tick: int):
+        self.record(RecordKind.DISCONNECT, self.client_ids.pop(client), tick)
+
+    def user(self, client, tick: int, user: dict):
+        self.record(RecordKind.USER, self.client_ids[client], tick, json.dumps(user).encode("utf-8"))
+
+    def character(self, client, tick: int, character: dict):
+        self.record(RecordKind.CHARACTER, self.client_ids[client], tick, json.dumps(character).encode("utf-8"))
+
+    def packet(self, client, tick: int, packet: NetworkPacket):
+        self.record(RecordKind.PACKET, self.client_ids[client], tick, packet.pack())
+
+    def schedule(self, tick: int, now: float):
+        self.record(RecordKind.SCHEDULE, 0, tick, timestamp=now)
+
+    def tick(self, tick: int, now: float):
+        self.record(RecordKind.TICK, 0, tick, timestamp=now)
+
+    def close(self):
+        self.file.close()
+
+    @classmethod
+    def read(cls, path: str) -> Iterator[Tuple[RecordKind, int, int, float, bytes]]:
+        with open(path, "rb") as file:
+            magic, version = cls.FILE_HEADER.unpack(file.read(cls.FILE_HEADER.size))
+            if magic != cls.MAGIC or version != cls.VERSION:
+                raise ValueError("{} is not a version {} packet recording".format(path, cls.VERSION))
+            while header := file.read(cls.RECORD_HEADER.size):
+                kind, client_id, tick, timestamp, size = cls.RECORD_HEADER.unpack(header)
+                yield RecordKind(kind), client_id, tick, timestamp, file.read(size)
@@ -0,0 +1,65 @@
+from bisect import bisect_left
+from typing import List
+
+
+class Histogram:
+    def __init__(self, bounds: List[float]):
+        self.bounds = bounds  # Upper bounds of every bucket but the last, which catches everything above them
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def stats(self) -> dict:
+        return {
+            "buckets": dict(zip([*self.bounds, float("inf")], self.counts)),
+            "count": self.total,
+            "mean": self.sum / self.total if self.total else 0.0,
+            "max": self.max
+        }
+
+
+class TickScheduler:
+    def __init__(self, tick_hz: float, max_catch_up_steps: int, histogram_bounds: List[float]):
+        self.interval = 1 / tick_hz
+        self.max_catch_up_steps = max_catch_up_steps  # Steps simulated at most per tick to catch up, further overdue steps are skipped
+        self.deadline = None  # Loop time at which the next tick is due, advanced by whole intervals so the schedule doesn't drift
+        self.tick = 0  # Number of simulated steps, including catch-up steps
+        self.skipped = 0  # Overdue steps given up on past max_catch_up_steps
+        self.durations = Histogram(histogram_bounds)  # Time spent validating, simulating and snapshotting the map in each tick, game state packets are built for all maps at once and not included
+        self.lateness = Histogram(histogram_bounds)  # Time between each tick's deadline and when it actually ran
+
+    def start(self, now: float):
+        self.deadline = now + self.interval
+
+    def delay(self, now: float) -> float:
+        return max(0.0, self.deadline - now)
+
+    def is_due(self, now: float) -> bool:
+        return now >= self.deadline
+
+    def advance(self, now: float) -> int:
+        # Returns the number of steps to simulate now, at least one once the deadline has passed
+        self.lateness.observe(now - self.deadline)
+        steps = int((now - self.deadline) // self.interval) + 1
+        if steps > self.max_catch_up_steps:
+            self.skipped += steps - self.max_catch_up_steps
+        self.deadline += steps * self.interval
+        steps = min(steps, self.max_catch_up_steps)
+        self.tick += steps
+        return steps
+
+    def stats(self) -> dict:
+        return {
+            "tick": self.tick,
+            "tick_hz": 1 / self.interval,
+            "skipped": self.skipped,
+            "duration": self.durations.stats(),
+            "lateness": self.lateness.stats()
+        }
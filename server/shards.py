@@ -0,0 +1,211 @@
+import multiprocessing, struct, time, json, traceback
+import numpy as np
+from enum import Enum
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional, List, Tuple
+from common.lib import NetworkPacket, GameStateCodec, MovementMode, MovementEvent
+from .entities import EntityStore, ENTRY_DTYPE
+from .world import World
+from .config import *
+
+
+class RingBuffer:
+    # Single producer, single consumer queue of length-prefixed messages in shared memory
+
+    HEADER = struct.Struct("QQQ")  # capacity, write offset (only written by the producer), read offset (only written by the consumer)
+    LENGTH = struct.Struct("!I")
+
+    def __init__(self, name: Optional[str] = None, capacity: int = 0):
+        if name is None:
+            self.memory = SharedMemory(create=True, size=self.HEADER.size + capacity)
+            self.HEADER.pack_into(self.memory.buf, 0, capacity, 0, 0)
+        else:
+            self.memory = SharedMemory(name=name)
+        self.name = self.memory.name
+        self.capacity = self.HEADER.unpack_from(self.memory.buf)[0]
+        self.data = self.memory.buf[self.HEADER.size:self.HEADER.size + self.capacity]
+        self.dropped = 0  # Messages discarded because the consumer fell behind
+
+    def offsets(self) -> Tuple[int, int]:
+        _, write_offset, read_offset = self.HEADER.unpack_from(self.memory.buf)
+        return write_offset, read_offset
+
+    def put(self, message: bytes) -> bool:
+        write_offset, read_offset = self.offsets()
+        size = self.LENGTH.size + len(message)
+        if size > self.capacity - (write_offset - read_offset):
+            self.dropped += 1
+            return False
+        self.copy_in(write_offset, self.LENGTH.pack(len(message)))
+        self.copy_in(write_offset + self.LENGTH.size, message)
+        # Publishing the offset last makes the message visible to the consumer only once it is complete
+        struct.pack_into("Q", self.memory.buf, 8, write_offset + size)
+        return True
+
+    def get_all(self) -> List[bytes]:
+        write_offset, read_offset = self.offsets()
+        messages = []
+        while read_offset < write_offset:
+            length = self.LENGTH.unpack(self.copy_out(read_offset, self.LENGTH.size))[0]
+            messages.append(self.copy_out(read_offset + self.LENGTH.size, length))
+            read_offset += self.LENGTH.size + length
+        struct.pack_into("Q", self.memory.buf, 16, read_offset)
+        return messages
+
+    def copy_in(self, offset: int, data: bytes):
+        start = offset % self.capacity
+        head = min(len(data), self.capacity - start)
+        self.data[start:start + head] = data[:head]
+        self.data[:len(data) - head] = data[head:]
+
+    def copy_out(self, offset: int, length: int) -> bytes:
+        start = offset % self.capacity
+        head = min(length, self.capacity - start)
+        return bytes(self.data[start:start + head]) + bytes(self.data[:length - head])
+
+    def close(self, unlink: bool = False):
+        self.data.release()
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+class ShardCommand(Enum):
+    SPAWN = 0  # Server to shard, an ENTRY_DTYPE record followed by the Character UUID
+    DESPAWN = 1  # Server to shard
+    MOVEMENT = 2  # Server to shard, a packed MovementEvent
+    ACK = 3  # Server to shard, a snapshot ID
+    PACKET = 4  # Shard to server, a packed NetworkPacket for the entity, either a game state or an error
+    RECORDS = 5  # Shard to server, ENTRY_DTYPE records of a map that was just simulated
+    STATS = 6  # Shard to server, JSON serialized World.tick_stats()
+
+
+SHARD_MESSAGE = struct.Struct("!BBH")  # ShardCommand, codec or 0, entity ID or 0
+SNAPSHOT_ID = struct.Struct("!I")
+
+
+def shard_message(command: ShardCommand, entity_id: int = 0, payload: bytes = b"", codec: int = 0) -> bytes:
+    return SHARD_MESSAGE.pack(command.value, codec, entity_id) + payload
+
+
+class ShardRouter:
+    # Stands in for an in-process World, running the maps in SHARD_WORKERS processes that own map_id % SHARD_WORKERS
+
+    def __init__(self, workers: int, entities: EntityStore, movement_mode: MovementMode):
+        self.entities = entities  # Mirror of the simulated state, kept up to date from the RECORDS of every shard
+        self.owners = np.full(entities.capacity + 1, -1, dtype=np.int16)  # Index of the shard simulating each entity ID, -1 for none
+        self.stats = {}  # Mapping of shard indices to their latest tick stats
+        self.shards = []  # (process, inbound RingBuffer, outbound RingBuffer) per shard
+        context = multiprocessing.get_context("spawn")
+        for index in range(workers):
+            inbound = RingBuffer(capacity=SHARD_RING_SIZE)
+            outbound = RingBuffer(capacity=SHARD_RING_SIZE)
+            process = context.Process(target=run_shard, args=(index, inbound.name, outbound.name, entities.capacity, movement_mode.value), daemon=True)
+            process.start()
+            self.shards.append((process, inbound, outbound))
+
+    def shard(self, map_id: Optional[int]) -> int:
+        return (map_id or 0) % len(self.shards)
+
+    def send(self, entity_id: int, message: bytes):
+        _, inbound, _ = self.shards[int(self.owners[entity_id])]
+        if not inbound.put(message):
+            print(f"[{self.__class__.__name__}] Shard {self.owners[entity_id]} is not keeping up, dropped a message for entity {entity_id}")
+
+    def spawn(self, entity_id: int, codec: GameStateCodec):
+        self.owners[entity_id] = self.shard(int(self.entities.map_ids[entity_id]))
+        record = self.entities.records(np.array([entity_id])).tobytes()
+        self.send(entity_id, shard_message(ShardCommand.SPAWN, entity_id, record + self.entities.uuids[entity_id].encode("utf-8"), codec.value))
+
+    def despawn(self, entity_id: int):
+        self.send(entity_id, shard_message(ShardCommand.DESPAWN, entity_id))
+        self.owners[entity_id] = -1
+
+    def move(self, entity_id: int, event: MovementEvent):
+        if self.owners[entity_id] >= 0:
+            self.send(entity_id, shard_message(ShardCommand.MOVEMENT, entity_id, event.pack()))
+
+    def ack(self, entity_id: int, snapshot_id: int):
+        if self.owners[entity_id] >= 0:
+            self.send(entity_id, shard_message(ShardCommand.ACK, entity_id, SNAPSHOT_ID.pack(snapshot_id)))
+
+    def delay(self, now: float) -> float:
+        return SHARD_POLL_INTERVAL
+
+    def tick(self, start_time: float) -> List[Tuple[int, NetworkPacket]]:
+        packets = []
+        for index, (process, _, outbound) in enumerate(self.shards):
+            if not process.is_alive():
+                raise RuntimeError("Shard {} exited with code {}".format(index, process.exitcode))
+            for message in outbound.get_all():
+                command, _, entity_id = SHARD_MESSAGE.unpack_from(message)
+                payload = memoryview(message)[SHARD_MESSAGE.size:]
+                match ShardCommand(command):
+                    case ShardCommand.PACKET:
+                        # The entity may have logged out while the packet was in flight
+                        if self.owners[entity_id] == index:
+                            packets.append((entity_id, NetworkPacket.unpack(payload)))
+                    case ShardCommand.RECORDS:
+                        records = np.frombuffer(payload, dtype=ENTRY_DTYPE)
+                        # Skip entities that logged out or were handed to another shard since
+                        self.entities.store(records[self.owners[records["entity_id"]] == index])
+                    case ShardCommand.STATS:
+                        # JSON turned the Map ID keys into strings
+                        self.stats[index] = {None if map_id == "null" else int(map_id): stats for map_id, stats in json.loads(str(payload, "utf-8")).items()}
+        return packets
+
+    def tick_stats(self) -> dict:
+        return {map_id: stats for shard_stats in self.stats.values() for map_id, stats in shard_stats.items()}
+
+    def close(self):
+        for process, inbound, outbound in self.shards:
+            process.terminate()
+            process.join()
+            inbound.close(unlink=True)
+            outbound.close(unlink=True)
+        self.shards.clear()
+
+
+def run_shard(index: int, inbound_name: str, outbound_name: str, capacity: int, movement_mode: int):
+    inbound = RingBuffer(inbound_name)
+    outbound = RingBuffer(outbound_name)
+    world = World(EntityStore(capacity), MovementMode(movement_mode))
+    parent = multiprocessing.parent_process()
+    stats_at = time.monotonic()
+    print(f"[Shard {index}] Started simulating maps")
+    try:
+        while parent is None or parent.is_alive():
+            for message in inbound.get_all():
+                command, codec, entity_id = SHARD_MESSAGE.unpack_from(message)
+                payload = memoryview(message)[SHARD_MESSAGE.size:]
+                match ShardCommand(command):
+                    case ShardCommand.SPAWN:
+                        world.entities.allocate(str(payload[ENTRY_DTYPE.itemsize:], "utf-8"), entity_id)
+                        world.entities.store(np.frombuffer(payload[:ENTRY_DTYPE.itemsize], dtype=ENTRY_DTYPE))
+                        world.spawn(entity_id, GameStateCodec(codec))
+                    case ShardCommand.DESPAWN:
+                        world.despawn(entity_id)
+                        world.entities.release(world.entities.uuids[entity_id])
+                    case ShardCommand.MOVEMENT:
+                        world.move(entity_id, MovementEvent.unpack(payload))
+                    case ShardCommand.ACK:
+                        world.ack(entity_id, SNAPSHOT_ID.unpack(payload)[0])
+
+            now = time.monotonic()
+            world.delay(now)
+            for entity_id, packet in world.tick(now):
+                outbound.put(shard_message(ShardCommand.PACKET, entity_id, packet.pack()))
+            for map_id in world.ticked:
+                outbound.put(shard_message(ShardCommand.RECORDS, payload=world.map_snapshots[map_id].records.tobytes()))
+            if now - stats_at >= 1:
+                outbound.put(shard_message(ShardCommand.STATS, payload=json.dumps(world.tick_stats()).encode("utf-8")))
+                stats_at = now
+            time.sleep(min(world.delay(time.monotonic()), SHARD_POLL_INTERVAL))
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"[Shard {index}] ERROR:", type(e).__name__, e)
+        traceback.print_exc()
+    finally:
+        inbound.close()
+        outbound.close()
@@ -0,0 +1,93 @@
+import numpy as np
+from collections import OrderedDict
+from typing import Optional, Tuple
+from common.lib import NetworkPacket, GameState, GameStateCodec, PlayerState
+from .entities import REPLICATED_FIELDS
+
+
+class SnapshotHistory:
+    def __init__(self, size: int):
+        self.size = size  # Number of snapshots kept as delta baselines before clients fall back to full snapshots
+        self.snapshots = OrderedDict()  # Mapping of snapshot IDs to ENTRY_DTYPE records sorted by entity ID
+        self.snapshot_id = None  # Latest recorded snapshot
+        self.delta_time = None  # delta_time of the latest recorded snapshot
+        self.packets = {}  # Mapping of (baseline ID, codec) to packets encoded from the latest snapshot, shared by every client on the map
+
+    @property
+    def records(self) -> np.ndarray:
+        return self.snapshots[self.snapshot_id]
+
+    def record(self, snapshot_id: int, records: np.ndarray, delta_time: float):
+        self.snapshots[snapshot_id] = records
+        while len(self.snapshots) > self.size:
+            # Clients that stopped acknowledging (lost packets or a stalled link) see their baseline age out here
+            self.snapshots.popitem(last=False)
+        self.snapshot_id = snapshot_id
+        self.delta_time = delta_time
+        self.packets.clear()
+
+    def baseline(self, acked_id: Optional[int]) -> Optional[int]:
+        if acked_id is not None and acked_id != self.snapshot_id and acked_id in self.snapshots:
+            return acked_id
+        return None
+
+    def packet(self, acked_id: Optional[int], codec: GameStateCodec) -> NetworkPacket:
+        baseline_id = self.baseline(acked_id)
+        packet = self.packets.get((baseline_id, codec))
+        if packet is None:
+            packet = self.delta_packet(self.records, baseline_id, self.snapshots.get(baseline_id), codec)
+            self.packets[(baseline_id, codec)] = packet
+        return packet
+
+    def filtered_packet(self, visible: np.ndarray, acked_id: Optional[int], acked_visible: Optional[np.ndarray], codec: GameStateCodec) -> NetworkPacket:
+        # visible holds the entity IDs a client can see now, acked_visible the ones it saw at acked_id
+        baseline_id = self.baseline(acked_id) if acked_visible is not None else None
+        records = self.records
+        records = records[np.isin(records["entity_id"], visible)]
+        baseline = None
+        if baseline_id is not None:
+            baseline = self.snapshots[baseline_id]
+            baseline = baseline[np.isin(baseline["entity_id"], acked_visible)]
+        return self.delta_packet(records, baseline_id, baseline, codec)
+
+    def delta_packet(self, records: np.ndarray, baseline_id: Optional[int], baseline: Optional[np.ndarray], codec: GameStateCodec) -> NetworkPacket:
+        removed = []
+        if baseline is not None:
+            changed, removed = diff_records(records, baseline)
+            records = records[changed]
+            removed = removed.tolist()
+
+        match codec:
+            case GameStateCodec.BINARY:
+                data = GameState.pack_entries(records.tobytes(), len(records), removed, snapshot_id=self.snapshot_id, baseline_id=baseline_id, delta_time=self.delta_time)
+            case _:
+                data = GameState(player_states=unpack_records(records), delta_time=self.delta_time, snapshot_id=self.snapshot_id, baseline_id=baseline_id, removed=removed).encode(codec)
+        return NetworkPacket(NetworkPacket.PacketType.GAMESTATE, data)
+
+
+def diff_records(records: np.ndarray, baseline: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Returns a mask of the records that are new or changed since the baseline, and the entity IDs that left it
+    entity_ids = records["entity_id"]
+    baseline_ids = baseline["entity_id"]
+    if len(baseline_ids) == 0:
+        return np.ones(len(records), dtype=bool), baseline_ids
+    index = np.minimum(np.searchsorted(baseline_ids, entity_ids), len(baseline_ids) - 1)
+    matched = baseline[index]
+    changed = matched["entity_id"] != entity_ids
+    for field in REPLICATED_FIELDS:
+        changed |= matched[field] != records[field]
+    removed = baseline_ids[~np.isin(baseline_ids, entity_ids)]
+    return changed, removed
+
+
+def unpack_records(records: np.ndarray) -> dict:
+    player_states = {}
+    for record in records:
+        player_states[int(record["entity_id"])] = PlayerState(
+            map_id=int(record["map_id"]),
+            position=(float(record["x"]), float(record["y"])),
+            travel_speed=int(record["travel_speed"]),
+            input_sequence=int(record["input_sequence"]),
+            updated_at=float(record["updated_at"])
+        )
+    return player_states
@@ -0,0 +1,194 @@
+import time
+import numpy as np
+from collections import OrderedDict
+from typing import Optional, List, Tuple, Callable
+from common.lib import NetworkPacket, GameStateCodec, MovementMode, MovementEvent, ErrorEvent, ErrorCode, ErrorSeverity, ErrorNature, calculate_velocity, SPRINT_MULTIPLIER
+from .snapshots import SnapshotHistory
+from .interest import InterestManager
+from .entities import EntityStore
+from .scheduler import TickScheduler
+from .collision import CollisionMaps
+from .history import PositionHistory
+from .config import *
+
+
+class World:
+    def __init__(self, entities: EntityStore, movement_mode: MovementMode, clock: Callable[[], float] = time.monotonic):
+        self.entities = entities
+        self.movement_mode = movement_mode
+        self.clock = clock
+        self.replication = {}  # Mapping of entity IDs of logged in players to dictionaries of their snapshot acknowledgement state
+        self.map_snapshots = {}  # Mapping of Map IDs to the SnapshotHistory shared by every player on that map
+        self.schedulers = {}  # Mapping of Map IDs to the TickScheduler of every map with players on it
+        self.interest = InterestManager(INTEREST_CELL_SIZE, VIEW_RADIUS, VIEW_HYSTERESIS) if VIEW_RADIUS is not None else None
+        self.collision = CollisionMaps(COLLISION_DIR, COLLISION_HIT_BOX)
+        self.history = PositionHistory(POSITION_HISTORY)  # Positions at the latest ticks, for rewinding to what clients saw
+        self.snapshot_id = 0  # ID of the latest snapshot produced by the simulation
+        self.ticked = []  # Map IDs simulated by the latest tick()
+
+    def spawn(self, entity_id: int, codec: GameStateCodec):
+        self.history.reset(entity_id)
+        if self.interest is not None:
+            self.interest.update(entity_id, self.map_id(entity_id), tuple(self.entities.positions[entity_id]))
+        self.replication[entity_id] = {"map_id": None, "acked_id": None, "visible": OrderedDict(), "codec": codec}
+
+    def despawn(self, entity_id: int):
+        if self.interest is not None:
+            self.interest.remove(entity_id)
+        self.replication.pop(entity_id, None)
+
+    def map_id(self, entity_id: int) -> Optional[int]:
+        return int(self.entities.map_ids[entity_id]) or None
+
+    def move(self, entity_id: int, event: MovementEvent):
+        if entity_id not in self.replication or event.sequence <= self.entities.input_sequences[entity_id]:
+            return
+        self.entities.input_sequences[entity_id] = event.sequence
+        self.entities.velocities[entity_id] = calculate_velocity(event.keys)
+        if self.movement_mode is MovementMode.POSITION and event.position is not None:
+            # Only the latest report per tick is kept, validate_movement() decides how much of it to accept
+            self.entities.reported[entity_id] = event.position
+            self.entities.pending[entity_id] = True
+
+    def ack(self, entity_id: int, snapshot_id: int):
+        replication = self.replication.get(entity_id)
+        if replication is None:
+            return
+        if replication["acked_id"] is None or snapshot_id > replication["acked_id"]:
+            replication["map_id"] = self.map_id(entity_id)
+            replication["acked_id"] = snapshot_id
+            while replication["visible"] and next(iter(replication["visible"])) < snapshot_id:
+                replication["visible"].popitem(last=False)
+
+    def delay(self, now: float) -> float:
+        self.update_schedulers(now)
+        return min((scheduler.delay(now) for scheduler in self.schedulers.values()), default=1 / SERVER_TICK_HZ)
+
+    def update_schedulers(self, now: float):
+        map_ids = {map_id or None for map_id in np.unique(self.entities.map_ids[self.entities.slots()]).tolist()}
+        for map_id in map_ids - self.schedulers.keys():
+            self.schedulers[map_id] = TickScheduler(MAP_TICK_HZ.get(map_id, SERVER_TICK_HZ), MAX_CATCH_UP_STEPS, TICK_HISTOGRAM_BOUNDS)
+            self.schedulers[map_id].start(now)
+        for map_id in self.schedulers.keys() - map_ids:
+            del self.schedulers[map_id]
+            self.map_snapshots.pop(map_id, None)
+
+    def tick(self, start_time: float) -> List[Tuple[int, NetworkPacket]]:
+        # Simulates every map that is due and returns the game state packets to send, keyed by the receiving entity ID
+        slots = self.entities.slots()
+        map_ids = self.entities.map_ids[slots]
+        self.ticked = []
+        packets = []
+        for map_id, scheduler in self.schedulers.items():
+            if not scheduler.is_due(start_time):
+                continue
+            skipped = scheduler.skipped
+            steps = scheduler.advance(start_time)
+            if scheduler.skipped > skipped:
+                print(f"[{self.__class__.__name__}] Map {map_id} fell behind, skipped {scheduler.skipped - skipped} ticks")
+            map_start_time = self.clock()
+            map_slots = slots[map_ids == (map_id or 0)]
+            packets.extend(self.validate_movement(map_id, map_slots, start_time, steps * scheduler.interval))
+            for _ in range(steps):
+                self.simulate_players(map_id, map_slots, scheduler.interval)
+            self.entities.touch(map_slots, start_time)
+            self.history.record(map_slots, self.entities.positions[map_slots], start_time)
+            self.record_snapshot(map_id, map_slots, steps * scheduler.interval)
+            scheduler.durations.observe(self.clock() - map_start_time)
+            self.ticked.append(map_id)
+        if not self.ticked:
+            return packets
+
+        for entity_id in self.replication:
+            if self.map_id(entity_id) in self.ticked:
+                packet = self.game_state_packet(entity_id)
+                if packet is not None:
+                    packets.append((entity_id, packet))
+        return packets
+
+    def rewind(self, entity_ids: np.ndarray, timestamp: float) -> np.ndarray:
+        # Positions of the entities as of the given server time, interpolated between ticks
+        return self.history.positions_at(entity_ids, timestamp)
+
+    def tick_stats(self) -> dict:
+        return {map_id: scheduler.stats() for map_id, scheduler in self.schedulers.items()}
+
+    def game_state_packet(self, entity_id: int) -> Optional[NetworkPacket]:
+        map_id = self.map_id(entity_id)
+        history = self.map_snapshots.get(map_id)
+        replication = self.replication[entity_id]
+        if history is None:
+            return None
+        # A baseline acknowledged on another map is meaningless here, so a map change starts over from a full snapshot
+        acked_id = replication["acked_id"] if replication["map_id"] == map_id else None
+        if self.interest is None:
+            return history.packet(acked_id, replication["codec"])
+
+        visible = replication["visible"]
+        visible[history.snapshot_id] = self.filter_entities(entity_id)
+        while len(visible) > SNAPSHOT_HISTORY:
+            visible.popitem(last=False)
+        return history.filtered_packet(visible[history.snapshot_id], acked_id, visible.get(acked_id), replication["codec"])
+
+    def filter_entities(self, entity_id: int) -> np.ndarray:
+        visible = self.interest.query(entity_id, self.entities.positions) or ()
+        return np.sort(np.fromiter(visible, dtype=np.int64))
+
+    def validate_movement(self, map_id: Optional[int], slots: np.ndarray, now: float, dt: float) -> List[Tuple[int, NetworkPacket]]:
+        # Checks every position reported since the last tick in one batch, returns the errors for repeat offenders
+        if self.movement_mode is not MovementMode.POSITION:
+            return []
+        self.entities.strikes[slots] = np.maximum(self.entities.strikes[slots] - dt * MOVEMENT_STRIKE_DECAY, 0)
+        moved = slots[self.entities.pending[slots]]
+        if len(moved) == 0:
+            return []
+        self.entities.pending[moved] = False
+
+        start = self.entities.positions[moved]
+        end = self.entities.reported[moved]
+        # NaN compares as within range and inf clamps to NaN, so non-finite reports are rolled back before anything else
+        non_finite = ~np.isfinite(end).all(axis=1)
+        end[non_finite] = start[non_finite]
+        displacement = end - start
+        distance = np.sqrt((displacement ** 2).sum(axis=1))
+        # Never shorter than the simulated time, even when a catch-up tick or a slow map covers more than MOVEMENT_BURST
+        elapsed = np.maximum(np.minimum(now - self.entities.validated_at[moved], max(MOVEMENT_BURST, dt)), dt)
+        allowed = self.entities.speeds[moved] * SPRINT_MULTIPLIER * elapsed * MOVEMENT_TOLERANCE
+        too_far = distance > allowed
+        if MOVEMENT_VIOLATION == "ROLLBACK":
+            end[too_far] = start[too_far]
+        else:
+            end[too_far] = start[too_far] + displacement[too_far] * (allowed[too_far] / distance[too_far])[:, np.newaxis]
+        violating = too_far | non_finite
+        grid = self.collision.get(map_id)
+        if grid is not None:
+            end = grid.clamp(start, end)
+        self.entities.move(moved, end)
+        self.entities.validated_at[moved] = now
+        if self.interest is not None:
+            for entity_id in moved.tolist():
+                self.interest.update(entity_id, map_id, tuple(self.entities.positions[entity_id]))
+
+        offenders = moved[violating]
+        self.entities.strikes[offenders] += 1
+        abusers = offenders[self.entities.strikes[offenders] >= MOVEMENT_STRIKE_LIMIT]
+        self.entities.strikes[abusers] = 0
+        packets = []
+        for entity_id in abusers.tolist():
+            error = ErrorEvent(ErrorCode.OUT_OF_BOUNDS, ErrorSeverity.MEDIUM, ErrorNature.ABUSE, "Repeatedly moved faster than allowed", "Movement of entity {}".format(entity_id))
+            packets.append((entity_id, NetworkPacket(NetworkPacket.PacketType.ERROR, error.serialize())))
+        return packets
+
+    def simulate_players(self, map_id: Optional[int], slots: np.ndarray, dt: float):
+        if self.movement_mode is not MovementMode.INPUT:
+            return
+        moved = self.entities.simulate(slots, dt, self.collision.get(map_id))
+        if self.interest is not None:
+            for entity_id in moved.tolist():
+                self.interest.update(entity_id, self.map_id(entity_id), tuple(self.entities.positions[entity_id]))
+
+    def record_snapshot(self, map_id: Optional[int], slots: np.ndarray, delta_time: float):
+        self.snapshot_id += 1
+        if map_id not in self.map_snapshots:
+            self.map_snapshots[map_id] = SnapshotHistory(SNAPSHOT_HISTORY)
+        self.map_snapshots[map_id].record(self.snapshot_id, self.entities.records(slots), delta_time)